@@ -0,0 +1,540 @@
+"""
+This script times the construction and output of large models.
+Run it with the names of the benchmarks to run as arguments,
+or without arguments to run all benchmarks.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import gc
+import math
+import os
+import pickle
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import reduce
+
+sys.path.append( "../psml" )
+import psml
+
+def timed( f ):
+   # like timeit, exclude the garbage collector from the timing
+   gc.collect()
+   gc.disable()
+   try:
+      start = time.perf_counter()
+      f()
+      return time.perf_counter() - start
+   finally:
+      gc.enable()
+
+def report_linear( name, sizes, build ):
+   """time build( n ) for each n in sizes,
+   and check that the time per part does not grow with n
+   """
+   print( name )
+   per_part = []
+   for n in sizes:
+      duration = timed( lambda: build( n ) )
+      per_part.append( duration / n )
+      print( "   %7d parts: %7.3f s, %6.2f us per part"
+         % ( n, duration, 1e6 * duration / n ) )
+   growth = per_part[ -1 ] / per_part[ 0 ]
+   print( "   time per part grows by a factor %.2f: %s" % (
+      growth, "linear" if growth < 2 else "NOT LINEAR" ))
+
+def accumulate( n ):
+   m = None
+   for i in range( n ):
+      m += psml.vector( i, 0, 0 ) ** psml.box( 1, 1, 1 )
+   return m
+
+def fold( n ):
+   return reduce(
+      lambda a, b: a + b,
+      ( psml.vector( i, 0, 0 ) ** psml.box( 1, 1, 1 ) for i in range( n ) ))
+
+def union_accumulation():
+   sizes = [ 12500, 25000, 50000, 100000 ]
+   report_linear( "union built with +=", sizes, accumulate )
+   report_linear( "union built with reduce", sizes, fold )
+
+def file_size( model, **options ):
+   model.write( "_benchmark.scad", **options )
+   size = os.path.getsize( "_benchmark.scad" )
+   os.remove( "_benchmark.scad" )
+   return size
+
+def nested_repeats():
+   print( "file size of nested repeat4 of a rounded box" )
+   for modules in [ False, True ]:
+      print( "   modules = %s" % modules )
+      m = psml.box( 10, 10, 10, rounding = 2 )
+      for level in range( 1, 5 ):
+         m = psml.repeat4( 20 * level, 20 * level ) ** m
+         print( "      %d levels: %9d bytes" % (
+            level, file_size( m, modules = modules )))
+
+def reference_transform( chain, p ):
+   """apply the chain of ( name, vector ) transformations to the point,
+   the last one first, without using matrices
+   """
+   x, y, z = p
+   for name, ( a, b, c ) in reversed( chain ):
+      if name == "translate":
+         x, y, z = x + a, y + b, z + c
+      elif name == "scale":
+         x, y, z = x * a, y * b, z * c
+      elif name == "mirror":
+         d = 2 * ( x * a + y * b + z * c ) / ( a * a + b * b + c * c )
+         x, y, z = x - d * a, y - d * b, z - d * c
+      elif name == "rotate":
+         for axis, angle in enumerate( ( a, b, c ) ):
+            cos, sin = math.cos( math.radians( angle )), math.sin( math.radians( angle ))
+            if axis == 0:
+               y, z = y * cos - z * sin, y * sin + z * cos
+            elif axis == 1:
+               x, z = x * cos + z * sin, - x * sin + z * cos
+            else:
+               x, y = x * cos - y * sin, x * sin + y * cos
+   return x, y, z
+
+def fused_transforms():
+   print( "transformation chains fused into a multmatrix" )
+   modifiers = {
+      "translate" : psml.vector, "rotate" : psml.rotate,
+      "mirror" : psml.mirror, "scale" : psml.scale }
+   random.seed( 1 )
+   worst = 0
+   for i in range( 1000 ):
+      chain = [
+         ( random.choice( list( modifiers )),
+           tuple( random.choice( [ 0, 90, random.uniform( -5, 5 ) ] )
+              for axis in range( 3 ) ) )
+         for length in range( random.randint( 2, 6 )) ]
+      chain = [ ( name, v ) for name, v in chain
+         if name != "mirror" or v != ( 0, 0, 0 ) ]
+      m = psml.box( 1, 1, 1 )
+      for name, v in reversed( chain ):
+         m = modifiers[ name ]( *v ) ** m
+      fused = psml._fuse_transforms( m._solid() ).children[ 0 ]
+      if len( chain ) > 1 and fused.name != "multmatrix":
+         print( "   NOT FUSED:", chain )
+         return
+      if fused.name != "multmatrix":
+         continue
+      matrix = fused.args[ 0 ][ 1 ]
+      for p in [ ( 0, 0, 0 ), ( 1, 2, 3 ), ( -7, 0.5, 11 ) ]:
+         q = [ sum( matrix[ r ][ c ] * ( p + ( 1, ) )[ c ] for c in range( 4 ))
+            for r in range( 3 ) ]
+         expected = reference_transform( chain, p )
+         size = max( [ 1 ] + [ abs( b ) for b in expected ] )
+         worst = max( worst, max( abs( a - b ) / size
+            for a, b in zip( q, expected )))
+   print( "   1000 random chains, largest relative deviation %g: %s" % (
+      worst, "equivalent" if worst < 1e-9 else "NOT EQUIVALENT" ))
+
+   m = psml.repeat4( 30, 30 ) ** psml.box( 10, 20, 30, rounding = 3 )
+   for fuse in [ False, True ]:
+      m.write( "_benchmark.scad", fuse_transforms = fuse )
+      text = open( "_benchmark.scad" ).read()
+      os.remove( "_benchmark.scad" )
+      print( "   rounded boxes, fuse_transforms = %s: %d blocks, %d bytes" % (
+         fuse, text.count( "{" ), len( text )))
+
+def examples():
+   """the models written by the example scripts in this directory
+
+   Each script runs in a copy of the current context, so settings
+   that it makes (like facets()) don't affect the other benchmarks.
+   """
+   models = []
+   original_write = psml.shape.write
+   psml.shape.write = lambda self, *args, **kwargs: models.append( self )
+   try:
+      for name in sorted( os.listdir( "." )):
+         if name.endswith( ".py" ) and not name.startswith( "_" ):
+            try:
+               contextvars.copy_context().run( exec,
+                  open( name ).read(), { "__name__" : "__main__" } )
+            except Exception:
+               pass
+   finally:
+      psml.shape.write = original_write
+   return models
+
+def parse_time( file_name ):
+   """the time OpenSCAD needs to read the file (and write it as .csg),
+   or None when OpenSCAD is not found
+   """
+   openscad = shutil.which( "openscad" )
+   if openscad == None:
+      return None
+   return timed( lambda: subprocess.run(
+      [ openscad, file_name, "-o", "_benchmark.csg" ],
+      stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL ))
+
+def compact_format():
+   print( "size and OpenSCAD parse time of the compact format" )
+   models = examples()
+   models.append( psml.repeat8( 20, 20, 20 ) ** psml.repeat8( 100, 100, 100 )
+      ** psml.box( 10, 10, 10, rounding = 2 ))
+   for compact in [ False, True ]:
+      size, duration = 0, 0
+      for model in models:
+         model.write( "_benchmark.scad",
+            modules = True, fuse_transforms = True, compact = compact )
+         size += os.path.getsize( "_benchmark.scad" )
+         t = parse_time( "_benchmark.scad" )
+         duration = None if t == None or duration == None else duration + t
+         os.remove( "_benchmark.scad" )
+      if os.path.exists( "_benchmark.csg" ):
+         os.remove( "_benchmark.csg" )
+      print( "   %d models, compact = %s: %8d bytes, parse time %s" % (
+         len( models ), compact, size,
+         "unknown (openscad not found)" if duration == None
+         else "%.3f s" % duration ))
+
+def serialization():
+   print( "saving and loading a model instead of generating it" )
+   def generate():
+      column = psml.screw_and_nut_column( 35, psml.m3_20 )
+      m = None
+      for i in range( 2000 ):
+         m += psml.vector( 10 * ( i % 50 ), 10 * ( i // 50 ), 0 ) ** (
+            psml.project_enclosure( psml.vector( 8, 8, 8 ), 1, 1 )
+            + psml.up( i ) ** column )
+      return m
+   models = []
+   print( "   generate: %7.3f s" % timed( lambda: models.append( generate() )))
+   m = models[ 0 ]
+   text = str( m )
+   for file_name in [ "_benchmark.psml", "_benchmark.json" ]:
+      save = timed( lambda: m.save( file_name ))
+      load = timed( lambda: models.append( psml.load( file_name )))
+      print( "   %-16s save %7.3f s, load %7.3f s, %8d bytes: %s" % (
+         file_name, save, load, os.path.getsize( file_name ),
+         "same" if str( models[ -1 ] ) == text else "NOT THE SAME" ))
+      os.remove( file_name )
+   data = []
+   dump = timed( lambda: data.append( pickle.dumps( m )))
+   load = timed( lambda: models.append( pickle.loads( data[ 0 ] )))
+   print( "   %-16s dump %7.3f s, load %7.3f s, %8d bytes: %s" % (
+      "pickle", dump, load, len( data[ 0 ] ),
+      "same" if str( models[ -1 ] ) == text else "NOT THE SAME" ))
+
+def deep_model( n ):
+   m = psml.box( 1, 1, 1 )
+   for i in range( n ):
+      m = psml.vector( i % 7, 1, 0 ) ** m + psml.sphere( 1 + i % 3 )
+   return m
+
+def fingerprints():
+   print( "fingerprint of a model" )
+   m = deep_model( 25000 )
+   nodes = sum( 1 for node in psml._postorder( m._solid() ))
+   fingerprint = []
+   print( "   %d nodes: %7.3f s" % ( nodes,
+      timed( lambda: fingerprint.append( m.fingerprint() ))))
+   bigger = psml.up( 1 ) ** m - psml.box( 2, 2, 2 )
+   print( "   a model built from that one: %7.3f s" % timed(
+      lambda: bigger.fingerprint() ))
+   other_run = subprocess.run( [ sys.executable, "-c",
+      "import _benchmark; print( _benchmark.deep_model( 25000 ).fingerprint() )" ],
+      capture_output = True, text = True ).stdout.split()[ -1 ]
+   print( "   in another run: %s" % (
+      "same" if other_run == fingerprint[ 0 ] else "NOT THE SAME" ))
+   print( "   int or float arguments: %s" % (
+      "same" if psml.box( 1, 2, 3 ).fingerprint()
+         == psml.box( 1.0, 2.0, 3.0 ).fingerprint() else "NOT THE SAME" ))
+
+def unchanged_write():
+   print( "writing a model that did not change" )
+   m = psml.repeat8( 50, 50, 50 ) ** fold( 20000 )
+   if os.path.exists( "_benchmark.scad" ):
+      os.remove( "_benchmark.scad" )
+   for attempt in [ "new file", "unchanged" ]:
+      written = []
+      duration = timed( lambda: written.append( m.write( "_benchmark.scad" )))
+      print( "   %-10s %7.3f s, written: %s" % ( attempt, duration, written[ 0 ] ))
+   os.remove( "_benchmark.scad" )
+
+def spheres( n ):
+   return ( psml.vector( i % 1000, i // 1000, 0 ) ** (
+      psml.sphere( 1 ) - psml.negative ** psml.box( 1, 1, 1 ) )
+      for i in range( n ))
+
+def peak_memory( f ):
+   tracemalloc.start()
+   try:
+      f()
+      return tracemalloc.get_traced_memory()[ 1 ]
+   finally:
+      tracemalloc.stop()
+
+def streamed_union():
+   print( "peak memory use of writing a union of n spheres" )
+   for n in [ 10000, 100000 ]:
+      for name, build in [
+         ( "reduce", lambda: reduce( lambda a, b: a + b, spheres( n ))),
+         ( "union_of", lambda: psml.union_of( spheres( n ))) ]:
+         memory = peak_memory(
+            lambda: build().write( "_benchmark.scad", compact = True ))
+         print( "   %7d parts, %-8s %8.1f MB" % ( n, name, memory / 1e6 ))
+   ( psml.up( 1 ) ** psml.union_of( spheres( 10 ))).write(
+      "_benchmark.scad", modules = True )
+   text = open( "_benchmark.scad" ).read()
+   print( "   moved, with modules: %d spheres, %d cubes, %d modules" % (
+      text.count( "sphere(" ), text.count( "cube(" ),
+      text.count( "module " )))
+   os.remove( "_benchmark.scad" )
+
+def apply_modifier( modifier, subject ):
+   return modifier ** subject
+
+def modifiers_in_processes():
+   print( "modifiers and shapes sent to worker processes" )
+   subject = psml.box( 10, 10, 10, rounding = 2 ) - psml.negative ** psml.sphere( 3 )
+   modifiers = [
+      psml.rotate( 10, 20, 30 ), psml.scale( 1, 2, 3 ), psml.mirror( 1, 0, 0 ),
+      psml.resize( 5, 5, 5 ), psml.color( 10, 20, 30 ), psml.red,
+      psml.repeat2( 1, 2, 3 ), psml.repeat4( 1, 2 ), psml.repeat8( 1, 2, 3 ),
+      psml.negative, psml.positive, psml.hull, psml.minkowski,
+      psml.extrude( 3 ), psml.rotate_extrude() ]
+   with concurrent.futures.ProcessPoolExecutor( 2 ) as pool:
+      results = list( pool.map( apply_modifier,
+         modifiers, [ subject ] * len( modifiers )))
+   same = all( str( r ) == str( m ** subject )
+      for r, m in zip( results, modifiers ))
+   print( "   %d modifiers: %s" % (
+      len( modifiers ), "same" if same else "NOT THE SAME" ))
+
+def pipelines():
+   print( "a chain of modifiers applied to many subjects" )
+   n = 20000
+   subjects = [ psml.box( 1 + i % 10, 1, 1 ) for i in range( n ) ]
+   h = 5
+   models = {}
+   def each():
+      models[ "each" ] = reduce( lambda a, b: a + b, (
+         psml.up( h ) ** psml.rotate( 180, 0, 0 ) ** psml.color( 255, 0, 0 )
+            ** subject for subject in subjects ))
+   def combined():
+      pipeline = psml.up( h ) ** psml.rotate( 180, 0, 0 ) ** psml.color( 255, 0, 0 )
+      models[ "combined" ] = reduce( lambda a, b: a + b, (
+         pipeline ** subject for subject in subjects ))
+   for name, build in [ ( "each", each ), ( "combined", combined ) ]:
+      duration = timed( build )
+      write = timed( lambda: models[ name ].write( "_benchmark.scad" ))
+      print( "   %-8s %d subjects: build %7.3f s, write %7.3f s" % (
+         name, n, duration, write ))
+   os.remove( "_benchmark.scad" )
+   print( "   same text: %s" % (
+      str( models[ "each" ] ) == str( models[ "combined" ] )))
+
+def parametric_modules():
+   print( "file size of screw columns of different heights" )
+   column = psml.module( psml.screw_and_nut_column )
+   for name, function in [
+      ( "plain", psml.screw_and_nut_column ), ( "module", column ) ]:
+      m = None
+      for i in range( 100 ):
+         m += psml.vector( 10 * i, 0, 0 ) ** function( 30 + i, psml.m3_20 )
+      print( "   %-6s 100 columns: %8d bytes" % (
+         name, file_size( m, modules = True, compact = True )))
+
+def top_level_parameters():
+   print( "ten wall thicknesses of a project enclosure" )
+   def enclosure( walls ):
+      return psml.hollow_box( psml.vector( 80, 60, 40 ), walls, 2 )
+   def variants():
+      for walls in range( 1, 11 ):
+         file_size( enclosure( walls ))
+   print( "   a file per variant:       %8.4f s" % timed( variants ))
+   walls = psml.parameter( "walls", 1 )
+   print( "   one file (-D walls=...):  %8.4f s" % timed(
+      lambda: file_size( enclosure( walls ))))
+   print( "   declares walls: %s" % (
+      "walls = 1" in str( enclosure( walls ))))
+
+def number_formats():
+   print( "file size of a polygon with 1000 points" )
+   def star( noise ):
+      return psml.polygon( [
+         ( 10 + 5 * ( i % 2 ) + noise ) * psml.vector(
+            math.cos( i * math.pi / 500 ), math.sin( i * math.pi / 500 ))
+         for i in range( 1000 ) ] )
+   for options in [
+      {}, { "compact" : True },
+      { "compact" : True, "quantum" : 0.001 },
+   ]:
+      print( "   %-36s %8d bytes" % ( options, file_size( star( 0 ), **options )))
+   star( 0 ).write( "_benchmark.scad", quantum = 0.001 )
+   print( "   rounding noise rewrites the file: %s" % (
+      star( 1e-12 ).write( "_benchmark.scad", quantum = 0.001 )))
+   os.remove( "_benchmark.scad" )
+
+def facets_in_threads():
+   print( "draft and final variants generated in parallel threads" )
+   def variant( n ):
+      with psml.facets( n ):
+         for _ in range( 200 ):
+            text = str( psml.sphere( 10 ) + psml.cylinder( height = 20, radius = 5 ))
+            if text.count( "$fn=%d " % n ) != 2:
+               return False
+      return True
+   with concurrent.futures.ThreadPoolExecutor( 8 ) as pool:
+      results = list( pool.map( variant, [ 8, 16, 32, 64 ] * 4 ))
+   print( "   each variant has its own facets: %s" % all( results ))
+
+def stl_cache():
+   print( "stl of an unchanged model, rendered twice" )
+   if shutil.which( "openscad" ) == None:
+      print( "   skipped: openscad not found" )
+      return
+   directory = tempfile.mkdtemp()
+   psml.stl_cache_directory = directory
+   try:
+      m = psml.hollow_box( psml.vector( 30, 20, 10 ), 1, 2 )
+      for run in [ "first", "second" ]:
+         print( "   %-6s %8.2f s" % (
+            run, timed( lambda: m.stl( "_benchmark.stl" ))))
+      os.remove( "_benchmark.stl" )
+      os.remove( "_output.scad" )
+   finally:
+      shutil.rmtree( directory )
+
+def parallel_renders():
+   print( "render 8 parts, one after another and in parallel" )
+   if shutil.which( "openscad" ) == None:
+      print( "   skipped: openscad not found" )
+      return
+   cache, psml.stl_cache_directory = psml.stl_cache_directory, None
+   directory = tempfile.mkdtemp()
+   try:
+      parts = {
+         os.path.join( directory, "part%d.stl" % i ) :
+            psml.sphere( 10 ) - psml.box( 5 + i, 5, 20 )
+         for i in range( 8 ) }
+      def serial():
+         for file_name, part in parts.items():
+            psml.render_many( { file_name : part }, jobs = 1 )
+      print( "   one at a time  %8.2f s" % timed( serial ))
+      print( "   render_many    %8.2f s" % timed(
+         lambda: psml.render_many( parts )))
+   finally:
+      psml.stl_cache_directory = cache
+      shutil.rmtree( directory )
+
+def asynchronous_renders():
+   print( "render 4 parts with stl_async(), one after another and together" )
+   if shutil.which( "openscad" ) == None:
+      print( "   skipped: openscad not found" )
+      return
+   cache, psml.stl_cache_directory = psml.stl_cache_directory, None
+   directory = tempfile.mkdtemp()
+   parts = [ psml.sphere( 10 ) - psml.box( 5 + i, 5, 20 ) for i in range( 4 ) ]
+   def name( i ):
+      return os.path.join( directory, "part%d" % i )
+   async def serial():
+      for i, part in enumerate( parts ):
+         await part.stl_async( name( i ))
+   async def together():
+      await asyncio.gather( *(
+         part.stl_async( name( i )) for i, part in enumerate( parts )))
+   try:
+      print( "   one at a time  %8.2f s" % timed(
+         lambda: asyncio.run( serial() )))
+      print( "   gathered       %8.2f s" % timed(
+         lambda: asyncio.run( together() )))
+   finally:
+      psml.stl_cache_directory = cache
+      shutil.rmtree( directory )
+
+def prerendered_parts():
+   print( "render a changed plate with prerendered screw columns" )
+   if shutil.which( "openscad" ) == None:
+      print( "   skipped: openscad not found" )
+      return
+   directory = tempfile.mkdtemp()
+   cache, psml.stl_cache_directory = psml.stl_cache_directory, directory
+   try:
+      for modifier in [ None, psml.prerender ]:
+         column = psml.screw_and_nut_column( 30, psml.m3_20 )
+         if modifier != None:
+            column = modifier ** column
+         for size in [ 50, 51 ]:
+            m = psml.box( size, size, 2 ) \
+               + psml.repeat4( 40, 40 ) ** column
+            print( "   %-9s plate %d  %8.2f s" % (
+               "prerender" if modifier else "plain", size,
+               timed( lambda: m.stl( "_benchmark.stl" ))))
+      os.remove( "_benchmark.stl" )
+      os.remove( "_output.scad" )
+   finally:
+      psml.stl_cache_directory = cache
+      shutil.rmtree( directory )
+
+def render_profiles():
+   print( "facets and Minkowski sums of a model, per profile" )
+   with psml.facets( 32 ):
+      m = psml.minkowski ** ( psml.box( 30, 20, 10 ) + psml.sphere( 2 )) \
+         - psml.repeat4( 20, 10 ) ** psml.vector( 5, 5, 0 ) \
+            ** psml.cylinder( height = 10, radius = 1.5, facets = 64 )
+   for name in [ "draft", "review", "final" ]:
+      m.write( "_benchmark.scad", profile = name )
+      text = open( "_benchmark.scad" ).read()
+      facets = sum( int( n ) for n in re.findall( r"\$fn=(\d+)", text ))
+      print( "   %-6s  facets %4d  minkowski %d" % (
+         name, facets, text.count( "minkowski" )))
+   os.remove( "_benchmark.scad" )
+
+def tolerance_facets():
+   print( "facets of a sieve (90 mm rim, 100 holes of 1 mm) at 200 facets" )
+   def sieve():
+      return psml.extrude( 3 ) ** (
+         psml.circle( radius = 45 )
+         - psml.circle( radius = 44 )
+         + psml.circle( radius = 40 )
+         - psml.union_of(
+            psml.vector( 8 * x - 40, 8 * y - 40 ) ** psml.circle( radius = 0.5 )
+            for x in range( 10 ) for y in range( 10 )))
+   for chord_error in [ None, 0.01, 0.05 ]:
+      with psml.facets( 200 ), psml.tolerance( chord_error ):
+         text = str( sieve() )
+      facets = sum( int( n ) for n in re.findall( r"\$fn=(\d+)", text ))
+      print( "   tolerance %-5s  facets %6d" % ( chord_error, facets ))
+
+benchmarks = {
+   "union" : union_accumulation,
+   "repeats" : nested_repeats,
+   "transforms" : fused_transforms,
+   "compact" : compact_format,
+   "serialize" : serialization,
+   "fingerprint" : fingerprints,
+   "unchanged" : unchanged_write,
+   "stream" : streamed_union,
+   "processes" : modifiers_in_processes,
+   "pipeline" : pipelines,
+   "parametric" : parametric_modules,
+   "parameters" : top_level_parameters,
+   "numbers" : number_formats,
+   "facets" : facets_in_threads,
+   "stl" : stl_cache,
+   "render_many" : parallel_renders,
+   "stl_async" : asynchronous_renders,
+   "prerender" : prerendered_parts,
+   "profiles" : render_profiles,
+   "tolerance" : tolerance_facets,
+}
+
+if __name__ == "__main__":
+   for name in sys.argv[ 1 : ] if len( sys.argv ) > 1 else benchmarks:
+      benchmarks[ name ]()
@@ -76,6 +76,8 @@ Repeat4 does this at the 4 corners of the rectangle
 specified by the vector.
 Repeat8 does this at the 8 corners of the box
 specified by the vector.
+The OpenSCAD code for the subject is written only once,
+in a loop over the positions.
 
 .. figure::  ../examples/images/intro_repeat1_128.png
     :target: ../examples/images/intro_repeat1_512.png
@@ -119,17 +121,39 @@ The examples use typeguard_ to check these hints.
 #============================================================================
 
 from __future__ import annotations
-from typing import Union, Tuple, Iterable
+from typing import Union, Tuple, Iterable, Any
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import hashlib
+import inspect
+import itertools
+import json
+import marshal
+import math
+import numbers
+import operator
 import os.path
+import shutil
 import subprocess
+import sys
+import tempfile
+import threading
+import time
 
 # specifiers used in the type annotations
 _shape_or_shape_list  = Union[ "shape", "_shape_list" ]
 _shape_or_none        = Union[ "shape", None ]
+_shape_or_modifier_or_none = Union[ "shape", "modifier", "vector", None ]
 _str_or_none          = Union[ str, None ]
 _float_or_vector      = Union[ float, "vector" ]
 _float_or_none        = Union[ float, None ]
 _vector_or_pair       = Union[ "vector", Tuple[float,float]]
+_str_or_node          = Union[ str, "_node" ]
+_node_or_none         = Union[ "_node", None ]
+_arguments            = Tuple[ Tuple[ _str_or_none, Any ], ... ]
+_arguments_or_none    = Union[ _arguments, None ]
 
 
 #============================================================================
@@ -144,7 +168,53 @@ number_of_sphere_facets   = 32
 number_of_text_facets     = 32
 number_of_extrude_facets  = 32
 
-def facets( numer_of_facets: int ) -> None:
+# the number of facets set by facets() in the current context,
+# or None to use the defaults above
+_facets = contextvars.ContextVar( "psml_facets", default = None )
+
+# the chord error set by tolerance() in the current context,
+# or None to use the number of facets
+_tolerance = contextvars.ContextVar( "psml_tolerance", default = None )
+
+# the minimum number of facets of a tolerance-based circle
+_minimum_facets = 5
+
+def _default_facets( kind: str, radius: _float_or_none = None ) -> int:
+    """the number of facets for a kind of primitive
+    ( "circle", "sphere", "text" or "extrude" ) in the current context,
+    for the radius (when it is known)
+
+    When a tolerance is set, the number of facets is the smallest
+    for which the distance between the (true) circle and its facets
+    is at most the tolerance: each facet spans an angle 2a
+    for which r * ( 1 - cos( a ) ) <= tolerance.
+    """
+    chord_error = _tolerance.get()
+    if chord_error != None and radius != None and float( radius ) > 0:
+        a = math.acos( max( -1.0, 1.0 - chord_error / float( radius ) ) )
+        return max( _minimum_facets, math.ceil( math.pi / a ) )
+    n = _facets.get()
+    if n == None:
+        return globals()[ "number_of_%s_facets" % kind ]
+    return n
+
+class _context_setting:
+    """a setting made in the current context (by facets()
+    or tolerance()), which can be undone
+    by using it as a context manager
+    """
+
+    def __init__( self, variable: contextvars.ContextVar, token ):
+        self._variable = variable
+        self._token = token
+
+    def __enter__( self ) -> "_context_setting":
+        return self
+
+    def __exit__( self, *exception ) -> None:
+        self._variable.reset( self._token )
+
+def facets( numer_of_facets: int ) -> _context_setting:
     """accuracy (number of facets) of circles, spheres and fonts
 
     The default setting (32) is a compromise between speed and accuracy.
@@ -155,6 +225,23 @@ def facets( numer_of_facets: int ) -> None:
     This function has effect on shapes that are created
     after its call, so better call it before you create any elements.
 
+    The setting is made in the current context (see the Python
+    contextvars module), so threads and asyncio tasks can each
+    use their own setting. A thread that is started by the
+    program starts with the default setting (an asyncio task,
+    and the work that psml itself does in other threads,
+    starts with the setting of its creator).
+    When it is used in a with statement,
+    the setting applies only to the shapes that are created
+    in the with block.
+
+    .. code-block::
+
+        with facets( 10 ):
+            draft = model()
+        with facets( 100 ):
+            final = model()
+
     .. figure::  ../examples/images/example_facets1_128.png
         :target: ../examples/images/example_facets1_512.png
     .. literalinclude:: ../examples/example_facets1.py
@@ -166,25 +253,100 @@ def facets( numer_of_facets: int ) -> None:
         :lines: 9, 11-12
     """
 
-    global number_of_circle_facets
-    number_of_circle_facets = numer_of_facets
+    return _context_setting( _facets, _facets.set( numer_of_facets ) )
 
-    global number_of_sphere_facets
-    number_of_sphere_facets = numer_of_facets
+def tolerance( chord_error: _float_or_none ) -> _context_setting:
+    """accuracy (maximum deviation) of circles, spheres and fonts
 
-    global number_of_text_facets
-    number_of_text_facets = numer_of_facets
+    :param chord_error: the maximum distance between a true circle
+                        and its facets, larger than 0
+                        (None: use facets())
 
-    global number_of_extrude_facets
-    number_of_extrude_facets = numer_of_facets
+    When a tolerance is set, the number of facets of each circle,
+    cylinder, cone, sphere and text is derived from its radius,
+    so a small hole gets a few facets, and a large rim many,
+    with the same accuracy.
+    (A number of facets that is specified for a shape is used as is,
+    and extrusions still use facets().)
+    Like facets(), it is set in the current context (so a thread
+    that is started by the program starts without a tolerance),
+    and it can be used in a with statement.
 
-def _indent( txt: str ) -> str:
-    """return the text with all lines indented one indent step
+    .. code-block::
+
+        # at most 0.01 mm from the true circle
+        tolerance( 0.01 )
+        circle( radius = 1 )    # 23 facets
+        circle( radius = 45 )   # 150 facets
+    """
+
+    if chord_error != None and not chord_error > 0:
+        raise ValueError(
+            "the tolerance must be larger than 0, not %r" % chord_error )
+    return _context_setting( _tolerance, _tolerance.set( chord_error ) )
+
+class profile:
+    """the settings that are used to write a model for a purpose,
+    like a quick draft or a final render
+
+    :param circle: the maximum number of facets of circles,
+                   cylinders and cones (None: no maximum)
+    :param sphere: the maximum number of facets of spheres
+    :param text: the maximum number of facets of text
+    :param extrude: the maximum number of facets (steps) of extrusions
+    :param minkowski: whether Minkowski sums are written (when False,
+                      each is replaced by the union of its shapes)
+
+    A profile is applied when a model is written
+    (see shape.write() and shape.stl()), so the same model can
+    be written as a draft or in full detail, without changing the
+    code that creates it (or its facets() calls).
+    A profile reduces the number of facets to its maximum,
+    but it never increases it.
+    Replacing a Minkowski sum (which is costly to render) by the
+    union of its shapes gives for instance a box with rounded
+    edges the shape of its (smaller) core, which is often good
+    enough for a draft. The union does not depend on the order of
+    the shapes, and it never leaves out the main shape (a shape that
+    sticks out of it, like a sphere at a corner, is usually small).
+
+    The profiles dict holds the profiles by name.
+    It initially holds "draft", "review" and "final"
+    (which changes nothing), and other profiles can be added.
+    """
+
+    def __init__( self,
+        circle: Union[ int, None ] = None,
+        sphere: Union[ int, None ] = None,
+        text: Union[ int, None ] = None,
+        extrude: Union[ int, None ] = None,
+        minkowski: bool = True
+    ):
+        self.facets = {
+            "circle" : circle, "sphere" : sphere,
+            "text" : text, "extrude" : extrude }
+        self.minkowski = minkowski
+
+    def __repr__( self ) -> str:
+        return "profile(%s, minkowski=%r)" % ( ", ".join(
+            "%s=%r" % item for item in self.facets.items() ), self.minkowski )
+
+profiles = {
+    "draft" : profile( 12, 12, 8, 8, minkowski = False ),
+    "review" : profile( 32, 32, 16, 32 ),
+    "final" : profile(),
+}
+
+def _profile( p: Union[ str, profile, None ] ) -> Union[ profile, None ]:
+    """the profile, which can be specified by its name
     """
-    return "".join( map(
-        lambda s: "" if s.strip() == "" else "   " + s + "\n",
-            txt.split( "\n" )
-        ))
+    if isinstance( p, str ):
+        try:
+            return profiles[ p ]
+        except KeyError:
+            raise ValueError( "unknown profile '%s' (known: %s)" % (
+                p, ", ".join( sorted( profiles ) ) ) ) from None
+    return p
 
 def _apply2(
     s1 : str,
@@ -201,19 +363,32 @@ def _apply2(
     :param b: second shape
     """
     if b == None:
-       b = shape( "", "" )
+       b = shape( _empty, _empty )
        if a == None:
           a = b
+    a, b = a._merge(), b._merge()
     return shape(
-        s1 + "{\n" + _indent(
-            a._positive() + "\n" +
-            b._positive() + "\n" ) +
-        "}",
-        s2 + "{\n" + _indent(
-            a._negative() + "\n" +
-            b._negative() + "\n" ) +
-        "}",
-    )
+        _boolean( s1, ( a._positive_node, b._positive_node ) ),
+        _boolean( s2, ( a._negative_node, b._negative_node ) ) )
+
+def _apply1(
+    name : str,
+    args : _arguments_or_none,
+    subject : _shape_or_none
+) -> _shape_or_none:
+    """apply an OpenSCAD transformation to a shape
+
+    :param name: name of the OpenSCAD operation
+    :param args: arguments of the operation,
+                 or None when the name is the full operation text
+    :param subject: the shape to which the operation is applied
+    """
+    if subject == None:
+        return None
+    subject = subject._merge()
+    return shape(
+        _transform( name, args, subject._positive_node ),
+        _transform( name, args, subject._negative_node ) )
 
 def apply(
     text : str,
@@ -239,15 +414,1301 @@ def apply(
     .. literalinclude:: ../examples/example_apply1.py
         :lines: 10
     """
-    text = text.replace( "'", '"' )
-    return None if subject == None else shape(
-        text + "{\n" + _indent(
-            subject._positive() + "\n" ) +
-        "}",
-        text + "{\n" + _indent(
-            subject._negative() + "\n" ) +
-        "}",
-    )
+    return _apply1( text.replace( "'", '"' ), None, subject )
+
+
+#============================================================================
+#
+# symbolic values
+#
+#============================================================================
+
+class _expression( float ):
+    """a number that is also an OpenSCAD expression
+
+    This is an implementation detail.
+
+    An expression is a float (so it can be used wherever a number
+    can be used) that also knows how it is computed from named
+    OpenSCAD values, like the parameters of a module.
+    Arithmetic (+, -, *, / and unary -) on an expression yields
+    an expression, so the OpenSCAD text can refer to the names
+    instead of containing the current values.
+    Anything else (like a comparison or math.sin) uses the value,
+    except for a strict expression: that is an expression of which
+    the value is not known (like a top-level parameter, which can be
+    set when OpenSCAD is run), and for which anything but arithmetic
+    raises an exception.
+
+    The term is the name, or an ( operator, operands ) tuple
+    in which each operand is a number or an expression.
+    """
+
+    def __new__( cls, value: float, term, strict: bool = False ):
+        self = float.__new__( cls, value )
+        self.term = term
+        self.strict = strict
+        return self
+
+    def __repr__( self ) -> str:
+        return "_expression(%r, %r)" % ( float( self ), self.term )
+
+    def __reduce__( self ):
+        return ( _expression, ( float( self ), self.term, self.strict ) )
+
+    def _check( self, use: str ):
+        """raise an exception when the value of a strict expression
+        would be used
+        """
+        if self.strict:
+            raise TypeError(
+                "a parameter can only be used in arithmetic "
+                "(+, -, * and /), not %s" % use )
+
+    def __eq__( self, other ):
+        if other is None:
+            return False
+        self._check( "in a comparison" )
+        return float.__eq__( self, other )
+
+    def __ne__( self, other ):
+        if other is None:
+            return True
+        self._check( "in a comparison" )
+        return float.__ne__( self, other )
+
+    def __lt__( self, other ):
+        self._check( "in a comparison" )
+        return float.__lt__( self, other )
+
+    def __le__( self, other ):
+        self._check( "in a comparison" )
+        return float.__le__( self, other )
+
+    def __gt__( self, other ):
+        self._check( "in a comparison" )
+        return float.__gt__( self, other )
+
+    def __ge__( self, other ):
+        self._check( "in a comparison" )
+        return float.__ge__( self, other )
+
+    def __bool__( self ):
+        self._check( "as a condition" )
+        return float.__bool__( self )
+
+    def __int__( self ):
+        self._check( "as an integer" )
+        return float.__int__( self )
+
+    def __round__( self, digits = None ):
+        self._check( "in round()" )
+        return float.__round__( self, digits )
+
+    __hash__ = float.__hash__
+
+    def __add__( self, other ):
+        return _arithmetic( "+", self, other )
+
+    def __radd__( self, other ):
+        return _arithmetic( "+", other, self )
+
+    def __sub__( self, other ):
+        return _arithmetic( "-", self, other )
+
+    def __rsub__( self, other ):
+        return _arithmetic( "-", other, self )
+
+    def __mul__( self, other ):
+        return _arithmetic( "*", self, other )
+
+    def __rmul__( self, other ):
+        return _arithmetic( "*", other, self )
+
+    def __truediv__( self, other ):
+        return _arithmetic( "/", self, other )
+
+    def __rtruediv__( self, other ):
+        return _arithmetic( "/", other, self )
+
+    def __neg__( self ):
+        return _expression( - float( self ), ( "-", ( self, ) ), self.strict )
+
+    def __pos__( self ):
+        return self
+
+# the Python functions of the OpenSCAD operators
+_operators = {
+    "+" : operator.add,
+    "-" : operator.sub,
+    "*" : operator.mul,
+    "/" : operator.truediv,
+}
+
+def _arithmetic( name: str, a, b ):
+    """the expression a <name> b, of which a or b is an expression
+    """
+    for x in ( a, b ):
+        if isinstance( x, bool ) or not isinstance( x, ( int, float ) ):
+            return NotImplemented
+    return _expression(
+        _operators[ name ]( float( a ), float( b ) ), ( name, ( a, b ) ),
+        any( getattr( x, "strict", False ) for x in ( a, b ) ) )
+
+def _is_symbolic( x ) -> bool:
+    """whether x is, or (as a tuple) contains, an expression
+    """
+    if isinstance( x, tuple ):
+        return any( _is_symbolic( v ) for v in x )
+    return isinstance( x, _expression )
+
+# the top-level parameters: their default values, by name
+_parameters = {}
+
+def _parameter_names( x, names ):
+    """add the names of the top-level parameters used in x
+    (an argument value) to the set
+    """
+    if isinstance( x, tuple ):
+        for v in x:
+            _parameter_names( v, names )
+    elif isinstance( x, _expression ) and x.strict:
+        if isinstance( x.term, str ):
+            names.add( x.term.split( "[" )[ 0 ] )
+        else:
+            _parameter_names( x.term[ 1 ], names )
+
+def parameter( name: str, default: _float_or_vector ) -> _float_or_vector:
+    """a top-level OpenSCAD parameter
+
+    :param name: the name of the parameter
+    :param default: the value (a number or a vector)
+
+    This function returns a value that can be used like a number
+    (or a vector) to create shapes, but in the OpenSCAD file
+    it is written as the parameter, which is written as
+    a top-level OpenSCAD variable with the default as its value.
+    When the file is processed by OpenSCAD, another value
+    can be set for the parameter (openscad -D name=value),
+    without running the Python code again.
+
+    Arithmetic (+, -, * and /) on a parameter produces a value
+    that is written as an OpenSCAD expression, but a parameter
+    can not be used for anything else, like a comparison
+    (that would need its value). Such a use raises an exception.
+
+    A parameter can be declared again (for instance when a script
+    is run again in the same Python session): the last default
+    is the one that is written.
+
+    .. code-block::
+
+        walls = parameter( "walls", 2 )
+        hollow_box( vector( 30, 20, 10 ), walls ).write()
+        # openscad -D walls=3 -o box.stl output.scad
+    """
+    if not name.isidentifier():
+        raise ValueError( "'%s' is not a valid parameter name" % name )
+    if isinstance( default, vector ):
+        _parameters[ name ] = _value( default )
+        return vector( *( None if v == None
+            else _expression( v, "%s[%d]" % ( name, i ), True )
+            for i, v in enumerate( default._list() ) ) )
+    _parameters[ name ] = default
+    return _expression( default, name, True )
+
+
+#============================================================================
+#
+# OpenSCAD tree
+#
+#============================================================================
+
+# OpenSCAD arguments that are formatted as integers
+_integer_arguments = ( "$fn", "convexity" )
+
+def _value( x ):
+    """the value of an OpenSCAD argument, as stored in a node
+
+    Vectors are stored as tuples, so the nodes contain only
+    plain (immutable) data.
+    """
+    if isinstance( x, vector ):
+        return tuple( v for v in x._list() if v != None )
+    if isinstance( x, list ):
+        return tuple( _value( v ) for v in x )
+    return x
+
+class _node:
+    """node in the tree of OpenSCAD operations that represents a shape
+
+    This is an implementation detail.
+
+    A shape holds trees of nodes, and a shape that is build from
+    other shapes refers to their trees instead of copying them.
+    A tree is converted to OpenSCAD text only when it is needed,
+    for instance when it is written to a file.
+    Nodes are never changed after they are created,
+    hence a node can be shared by many trees.
+    """
+
+    children = ()
+
+    # the text of the (sub)tree, once it has been produced
+    _cached_text = None
+
+    # the fingerprint of the (sub)tree, once it has been computed
+    _cached_digest = None
+
+    def _head( self, writer: _writer ) -> str:
+        """the OpenSCAD text of the node itself (without its children),
+        formatted by the writer
+        """
+        raise NotImplementedError
+
+    def _with_children( self, children: Tuple[ _node, ... ] ) -> _node:
+        """a node like this one, but with the children
+        """
+        return self
+
+    def _text( self ) -> str:
+        """the OpenSCAD text representation of the (sub)tree
+
+        The text is produced only once: a node never changes.
+        """
+        if self._cached_text == None:
+            chunks = []
+            _writer( chunks.append ).node( self )
+            self._cached_text = "".join( chunks ).rstrip( "\n" )
+        return self._cached_text
+
+class _raw( _node ):
+    """node that holds OpenSCAD text that is used as-is
+    """
+
+    def __init__( self, text: str ):
+        self.text = text
+
+    def _head( self, writer: _writer ) -> str:
+        return self.text
+
+class _primitive( _node ):
+    """node for a basic OpenSCAD shape, like cube() or sphere()
+    """
+
+    def __init__( self, name: str, args: _arguments ):
+        self.name = name
+        self.args = args
+
+    def _head( self, writer: _writer ) -> str:
+        return self.name + writer._arguments( self.args ) + ";"
+
+class _block( _node ):
+    """node for an OpenSCAD operation that is applied to its children
+    """
+
+    def _operation( self, writer: _writer ) -> str:
+        raise NotImplementedError
+
+    def _head( self, writer: _writer ) -> str:
+        return self._operation( writer ) + "{"
+
+class _transform( _block ):
+    """node for an OpenSCAD transformation, like translate() or color()
+
+    When args is None, the name is the full text of the operation.
+    """
+
+    def __init__( self, name: str, args: _arguments_or_none, child: _node ):
+        self.name = name
+        self.args = args
+        self.children = ( child, )
+
+    def _operation( self, writer: _writer ) -> str:
+        if self.args == None:
+            return self.name
+        return self.name + writer._arguments( self.args )
+
+    def _with_children( self, children: Tuple[ _node, ... ] ) -> _node:
+        return _transform( self.name, self.args, children[ 0 ] )
+
+class _boolean( _block ):
+    """node for an OpenSCAD operation on a number of shapes,
+    like union() or difference()
+    """
+
+    def __init__( self, name: str, children: Tuple[ _node, ... ] ):
+        self.name = name
+        self.children = children
+
+    def _operation( self, writer: _writer ) -> str:
+        return self.name + "()"
+
+    def _with_children( self, children: Tuple[ _node, ... ] ) -> _node:
+        return _boolean( self.name, children )
+
+class _repeat( _transform ):
+    """node that places its child at each of a list of positions
+
+    The child is written only once, in an OpenSCAD for loop.
+    """
+
+    def __init__( self, positions: Tuple[ Tuple[ float, ... ], ... ], child: _node ):
+        _transform.__init__( self, "for", ( ( None, positions ), ), child )
+
+    def _operation( self, writer: _writer ) -> str:
+        return "for%s%stranslate%s" % (
+            writer._format_arguments(
+               ( ( "", "psml_position=" + writer._value( self.args[ 0 ][ 1 ] )), )),
+            "" if writer._compact else " ",
+            writer._format_arguments( ( ( "", "psml_position" ), ) ) )
+
+    def _with_children( self, children: Tuple[ _node, ... ] ) -> _node:
+        return _repeat( self.args[ 0 ][ 1 ], children[ 0 ] )
+
+class _stream( _node ):
+    """node for the union of shapes that are taken from an iterator
+
+    The shapes are not stored: each shape is written
+    when it is taken from the iterator, so the iterator can be
+    used only once. A union_of() shape has two stream nodes,
+    for its positive and for its negative parts, that share
+    the iterator. The positive stream is written first (the
+    positive parts of a shape are always written before its negative
+    parts), and it saves the text of the negative parts in a
+    temporary file, from which the negative stream copies it
+    (at its own depth).
+    """
+
+    def __init__( self, source: _stream_source, negative: bool ):
+        self.source = source
+        self.negative = negative
+
+    def _head( self, writer: _writer ) -> str:
+        return "union(){"
+
+    def _stream( self, writer: _writer, depth: int ):
+        """write the union at the depth
+        """
+        source = self.source
+        if self.negative:
+            if source.spool == None:
+                raise RuntimeError(
+                    "the negative parts of a union_of() "
+                    "can not be written before its positive parts" )
+            if source.spool.tell() > 0:
+                writer._line( depth, "union(){" )
+                source.spool.seek( 0 )
+                if writer._compact:
+                    writer.flush()
+                    for text in iter(
+                        lambda: source.spool.read( writer._chunk_size ), ""
+                    ):
+                        writer._write( text )
+                else:
+                    for line in source.spool:
+                        writer._line( depth + 1, line.rstrip( "\n" ) )
+                writer._line( depth, "}" )
+            source.spool.close()
+            return
+
+        if source.spool != None:
+            raise RuntimeError(
+                "the shapes of a union_of() can be written only once" )
+        source.spool = tempfile.TemporaryFile( "w+" )
+        negatives = _writer( source.spool.write,
+            fuse_transforms = writer._fuse_transforms,
+            simplify = writer._simplify,
+            compact = writer._compact,
+            quantum = writer._quantum,
+            settings = writer._settings )
+        writer._line( depth, "union(){" )
+        for subject in source.shapes:
+            subject = subject._merge()
+            writer._subtree( subject._positive_node, depth + 1 )
+            negatives._subtree( subject._negative_node, 0 )
+        negatives.flush()
+        writer._line( depth, "}" )
+
+class _stream_source:
+    """the iterator of the shapes of a union_of(),
+    and the temporary file for the text of their negative parts
+    """
+
+    def __init__( self, shapes: Iterable[ shape ] ):
+        self.shapes = iter( shapes )
+        self.spool = None
+
+class _call( _node ):
+    """node for a call of a parametric module (see module)
+
+    The args are the values of the parameters of the module.
+    The body of the module (its positive or negative parts)
+    is not a child: it is written once, as the module definition.
+    """
+
+    def __init__( self,
+        definition: _module_definition,
+        negative: bool,
+        args: _arguments
+    ):
+        self.definition = definition
+        self.name = definition.name + ( "_negative" if negative else "" )
+        self.body = definition.negative if negative else definition.positive
+        self.args = args
+
+    def _head( self, writer: _writer ) -> str:
+        return self.name + writer._arguments( self.args ) + ";"
+
+_empty = _raw( "" )
+
+def _decimals( quantum: float ) -> int:
+    """the number of decimals of a quantum (like 2 for 0.25)
+    """
+    text = repr( float( quantum ) )
+    if "e" in text:
+        mantissa, exponent = text.split( "e" )
+        return max( 0, len( mantissa.partition( "." )[ 2 ] ) - int( exponent ) )
+    return len( text.partition( "." )[ 2 ].rstrip( "0" ) )
+
+@functools.lru_cache( maxsize = 1 << 12 )
+def _number_text( x: float, quantum: float ) -> str:
+    """the OpenSCAD text of a number
+
+    The text is the shortest text that reads back as the same
+    number (without a trailing .0), so small values (below 1e-6)
+    and the last bits of a value are never lost.
+
+    When quantum is not 0, the number is first rounded to
+    a multiple of the quantum, and written with
+    (at most) the decimals of the quantum, so numbers that differ
+    by less than the quantum have the same text.
+    """
+    if quantum:
+        text = "%.*f" % (
+            _decimals( quantum ), round( x / quantum ) * quantum )
+        if "." in text:
+            text = text.rstrip( "0" ).rstrip( "." )
+    else:
+        text = repr( float( x ) )
+        if text.endswith( ".0" ):
+            text = text[ : -2 ]
+    if text.startswith( "-" ) and float( text ) == 0:
+        text = text[ 1 : ]
+    return text
+
+class _writer:
+    """writes the OpenSCAD text of a tree of nodes
+
+    This is an implementation detail.
+
+    The tree is walked without recursion (a model can be nested
+    deeper than Python's recursion limit), and the text is passed
+    in chunks to the write function as it is produced,
+    so the full text never has to be in memory.
+    The indentation is derived from the depth of each node
+    instead of re-indenting the text of each subtree.
+
+    The compact format, for files that are read only by OpenSCAD,
+    has no indentation, no newlines (except after raw text, which
+    could end in a comment), and no spaces.
+
+    The top-level parameters that are used in the tree,
+    and the modules of the parametric module calls in the tree,
+    are written first.
+    """
+
+    # flush the collected text when it exceeds this size
+    _chunk_size = 1 << 16
+
+    # the maximum number of remembered argument texts
+    _argument_texts_size = 1 << 12
+
+    def __init__( self,
+        write,
+        modules: bool = False,
+        fuse_transforms: bool = False,
+        simplify: bool = False,
+        compact: bool = False,
+        symbols: bool = True,
+        quantum: float = 0,
+        settings: Union[ profile, None ] = None
+    ):
+        """create a writer that passes its text to the write function
+
+        :param write: function that is called with each chunk of text
+        :param modules: whether repeated subtrees are written
+                        only once, as OpenSCAD modules
+        :param fuse_transforms: whether chains of transformations
+                        are replaced by a single multmatrix
+        :param simplify: whether structure that has no effect
+                        is removed from the tree
+        :param compact: whether the compact format is used
+        :param symbols: whether expressions are written as expressions
+                        (instead of as their values)
+        :param quantum: when not 0, numbers are rounded
+                        to a multiple of it
+        :param settings: the profile that is applied (None: no profile)
+        """
+        self._write = write
+        self._compact = compact
+        self._quantum = quantum
+        self._settings = settings
+        self._symbols = symbols
+        self._separator = "," if compact else ", "
+        self._simplify = simplify
+        self._modules = modules
+        self._fuse_transforms = fuse_transforms
+        self._chunks = []
+        self._size = 0
+        self._indents = [ "" ]
+        self._argument_texts = {}
+
+    def _indent( self, depth: int ) -> str:
+        while len( self._indents ) <= depth:
+            self._indents.append( self._indents[ -1 ] + "   " )
+        return self._indents[ depth ]
+
+    def _number( self, x ) -> str:
+        """the OpenSCAD text representation of a number
+        """
+        if isinstance( x, _expression ):
+            if self._symbols:
+                return self._term( x )[ 0 ]
+            x = float( x )
+        return _number_text( x, self._quantum )
+
+    def _value( self, x, integer: bool = False ) -> str:
+        """the OpenSCAD text representation of an argument value
+        """
+        if isinstance( x, bool ):
+            return "true" if x else "false"
+        if isinstance( x, str ):
+            return '"%s"' % x
+        if isinstance( x, tuple ):
+            if self._compact:
+                return "[%s]" % ",".join( self._value( v ) for v in x )
+            return "[ %s ]" % ", ".join( self._value( v ) for v in x )
+        if integer and not isinstance( x, _expression ):
+            return "%d" % x
+        return self._number( x )
+
+    # the precedence of the OpenSCAD operators
+    _precedence = { "+" : 1, "-" : 1, "*" : 2, "/" : 2 }
+
+    def _term( self, x ) -> Tuple[ str, int ]:
+        """the OpenSCAD text of a number or an expression,
+        and the precedence of its outermost operator
+
+        The precedence of a name or a number is highest (4),
+        that of a negation is 3.
+        """
+        if not isinstance( x, _expression ):
+            text = self._number( x )
+            return text, 3 if text.startswith( "-" ) else 4
+        if isinstance( x.term, str ):
+            return x.term, 4
+        name, operands = x.term
+        if len( operands ) == 1:
+            text, precedence = self._term( operands[ 0 ] )
+            return "-" + ( text if precedence > 3 else "(%s)" % text ), 3
+        precedence = self._precedence[ name ]
+        texts = []
+        for i, operand in enumerate( operands ):
+            text, operand_precedence = self._term( operand )
+            # a - ( b - c ), a / ( b * c ) and a * ( b / c ) need
+            # the parentheses (and they are kept for a + ( b + c ),
+            # because floating point addition is not associative)
+            if operand_precedence < precedence or (
+                i == 1 and operand_precedence == precedence
+            ):
+                text = "(%s)" % text
+            texts.append( text )
+        separator = name if self._compact else " %s " % name
+        return separator.join( texts ), precedence
+
+    def _arguments( self, args: _arguments ) -> str:
+        """the OpenSCAD text representation of a list of arguments
+
+        An argument is a ( name, value ) pair.
+        When the name is None the argument is positional,
+        when the name is "" the value is text that is used as-is.
+
+        The text is remembered for the arguments (object),
+        because nodes that are made by the same modifier
+        (for instance for each subject of a combined modifier)
+        share their arguments.
+        The remembered arguments are kept alive,
+        so their id() identifies them.
+        """
+        remembered = self._argument_texts.get( id( args ) )
+        if remembered != None and remembered[ 0 ] is args:
+            return remembered[ 1 ]
+        if len( self._argument_texts ) >= self._argument_texts_size:
+            self._argument_texts.clear()
+        text = self._format_arguments( args )
+        self._argument_texts[ id( args ) ] = ( args, text )
+        return text
+
+    def _format_arguments( self, args: _arguments ) -> str:
+        text = self._separator.join(
+            self._value( value ) if name == None
+            else value if name == ""
+            else "%s=%s" % (
+               name, self._value( value, name in _integer_arguments ) )
+            for name, value in args )
+        if self._compact or text == "":
+            return "(%s)" % text
+        return "( %s )" % text
+
+    def _line( self, depth: int, text: str, raw: bool = False ):
+        """add a line of text at the depth
+
+        A raw line is OpenSCAD text from the user.
+        """
+        if self._compact:
+            text = text + "\n" if raw else text
+        elif "\n" in text:
+            for line in text.split( "\n" ):
+                if line.strip() != "":
+                    self._line( depth, line )
+            return
+        else:
+            text = self._indent( depth ) + text + "\n"
+        self._chunks.append( text )
+        self._size += len( text )
+        if self._size > self._chunk_size:
+            self.flush()
+
+    def flush( self ):
+        """pass the collected text to the write function
+        """
+        if self._chunks:
+            self._write( "".join( self._chunks ) )
+            self._chunks = []
+            self._size = 0
+
+    def _optimized( self, root: _node ) -> _node:
+        """the tree with the profile applied, simplified,
+        and with fused transformations (when the writer does so)
+        """
+        if self._settings != None:
+            root = _apply_profile( root, self._settings )
+        if self._simplify:
+            root = _simplify( root )
+        if self._fuse_transforms:
+            root = _fuse_transforms( root )
+        return root
+
+    def node( self, root: _node ):
+        """write the text of the tree
+        """
+        root = self._optimized( root )
+        definitions = self._module_definitions( root )
+        if _parameters:
+            names = set()
+            for parameters, tree in [ ( (), root ) ] + [
+                ( parameters, body ) for _, parameters, body in definitions
+            ]:
+                used = set()
+                for node in _postorder( tree ):
+                    _parameter_names( getattr( node, "args", None ), used )
+                names |= used.difference( parameters )
+            for name in sorted( names.intersection( _parameters ) ):
+                self._line( 0, "%s%s%s;" % ( name,
+                    "=" if self._compact else " = ",
+                    self._value( _parameters[ name ] ) ) )
+        for name, parameters, body in definitions:
+            self._line( 0, "module %s(%s){" % (
+                name, self._separator.join( parameters ) ) )
+            self._subtree( body, 1 )
+            self._line( 0, "}" )
+        calls = self._find_modules( root ) if self._modules else {}
+        for name, node in calls.values():
+            if node != None:
+                self._line( 0, "module %s(){" % name )
+                self._tree( node, 1, calls )
+                self._line( 0, "}" )
+        self._tree( root, 0, calls )
+        self.flush()
+
+    def _module_definitions( self, root: _node ):
+        """the ( name, parameters, body ) of each parametric module
+        that is called in the tree, or in the body of such a module
+        """
+        definitions = []
+        seen = set()
+        roots = [ root ]
+        while roots:
+            for node in _postorder( roots.pop() ):
+                if isinstance( node, _call ) and node.name not in seen:
+                    seen.add( node.name )
+                    definitions.append( ( node.name,
+                        node.definition.parameters, node.body ) )
+                    roots.append( node.body )
+        return definitions
+
+    def _subtree( self, root: _node, depth: int ):
+        """write the text of a part of the tree at the depth,
+        without modules
+        """
+        self._tree( self._optimized( root ), depth, {} )
+
+    def _tree( self, root: _node, depth: int, calls ):
+        """write the text of the tree at the depth
+
+        Nodes that are found in calls (except the root)
+        are written as a call of their module.
+        """
+
+        # each entry is a node and its depth, or the closing
+        # brace of a block ( None ) and its depth
+        stack = [ ( root, depth ) ]
+        while stack:
+            node, depth = stack.pop()
+            if node == None:
+                self._line( depth, "}" )
+            elif node is not root and id( node ) in calls:
+                self._line( depth, calls[ id( node ) ][ 0 ] + "();" )
+            elif isinstance( node, _stream ):
+                node._stream( self, depth )
+            elif isinstance( node, _block ):
+                self._line( depth, node._head( self ),
+                    getattr( node, "args", () ) == None )
+                stack.append( ( None, depth ) )
+                stack.extend(
+                    ( child, depth + 1 ) for child in reversed( node.children ) )
+            else:
+                text = node._head( self )
+                if text != "":
+                    self._line( depth, text, isinstance( node, _raw ) )
+
+    # a leaf that is repeated becomes a module when its text
+    # is at least this long
+    _module_leaf_size = 100
+
+    def _find_modules( self, root: _node ):
+        """find the repeated subtrees that are written as a module
+
+        Subtrees that produce the same text are identified by giving
+        each distinct ( head text, child structures ) combination
+        a number (each stream is a distinct structure, because its
+        text is not known in advance). A structure that is used more
+        than once (by different parents, or more than once by the same
+        parent) becomes a module, unless it is too small to be worth it:
+        a block without any lines between its braces, or a short leaf.
+
+        The result maps the id() of each node that is written as
+        a module call to ( module name, node ).
+        The node is None except for one node per module,
+        which is the node that must be written as the module body.
+        """
+        structure_of = {}
+        structures = {}
+        first = []
+        lines = []
+        for node in _postorder( root ):
+            head = node._head( self )
+            children = tuple( structure_of[ id( c ) ] for c in node.children )
+            key = ( head, children )
+            if isinstance( node, _stream ):
+                # the text of a stream is not known before it is written
+                key = ( head, id( node ) )
+            n = structures.get( key )
+            if n == None:
+                n = structures[ key ] = len( first )
+                first.append( node )
+                lines.append(
+                    2 + sum( lines[ c ] for c in children )
+                    if isinstance( node, _block ) else int( head != "" ))
+            structure_of[ id( node ) ] = n
+
+        uses = [ 0 ] * len( first )
+        for node in first:
+            for child in node.children:
+                uses[ structure_of[ id( child ) ] ] += 1
+
+        names = {}
+        for n, node in enumerate( first ):
+            if uses[ n ] > 1 and ( lines[ n ] > 2 if isinstance( node, _block )
+                else len( node._head( self ) ) >= self._module_leaf_size ):
+                names[ n ] = "psml_%d" % ( len( names ) + 1 )
+
+        calls = {}
+        for n, name in names.items():
+            calls[ id( first[ n ] ) ] = ( name, first[ n ] )
+        for node_id, n in structure_of.items():
+            if n in names and node_id not in calls:
+                calls[ node_id ] = ( names[ n ], None )
+        return calls
+
+def _postorder( root: _node ):
+    """the nodes of the tree, each child before its parent
+
+    Each node is produced once, even when it occurs at more than
+    one place in the tree. The tree is walked without recursion.
+    """
+    seen = set()
+    stack = [ ( root, False ) ]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            yield node
+        elif id( node ) not in seen:
+            seen.add( id( node ) )
+            stack.append( ( node, True ) )
+            stack.extend(
+                ( child, False ) for child in reversed( node.children ) )
+
+
+#============================================================================
+#
+# OpenSCAD tree optimizations
+#
+#============================================================================
+
+def _rewrite( root: _node, function ) -> _node:
+    """the tree, with each node replaced by function( node )
+
+    The function gets the node, of which the children have already
+    been replaced, and returns the replacement for the node.
+    The tree is walked without recursion, and a node that occurs
+    at more than one place is replaced only once.
+    Nodes are copied only when a child was replaced.
+    """
+    replacement = {}
+    for node in _postorder( root ):
+        children = tuple( replacement[ id( c ) ] for c in node.children )
+        if any( new is not old for new, old in zip( children, node.children )):
+            replacement[ id( node ) ] = function(
+                node._with_children( children ))
+        else:
+            replacement[ id( node ) ] = function( node )
+    return replacement[ id( root ) ]
+
+def _cos_sin( degrees: float ) -> Tuple[ float, float ]:
+    """the cosine and sine of an angle in degrees
+
+    Like in OpenSCAD, the result is exact for multiples of 90 degrees.
+    """
+    if degrees % 90 == 0:
+        return (( 1, 0 ), ( 0, 1 ), ( -1, 0 ), ( 0, -1 ))[
+            int( degrees // 90 ) % 4 ]
+    radians = math.radians( degrees )
+    return math.cos( radians ), math.sin( radians )
+
+def _matrix_product( a, b ):
+    """the product of two 4x4 matrices
+    """
+    return tuple(
+        tuple( sum( a[ i ][ k ] * b[ k ][ j ] for k in range( 4 ))
+            for j in range( 4 ))
+        for i in range( 4 ))
+
+def _transform_matrix( node: _node ):
+    """the 4x4 matrix of a translate, rotate, mirror, scale
+    or multmatrix node, or None for any other node
+
+    Missing z values are 0, except for scale, where it is 1
+    (as in OpenSCAD).
+    """
+    if type( node ) != _transform or node.args == None or len( node.args ) != 1:
+        return None
+    if _is_symbolic( node.args ):
+        return None
+    v = node.args[ 0 ][ 1 ]
+    if node.name == "multmatrix":
+        return v
+    x, y, z = v[ 0 ], v[ 1 ], v[ 2 ] if len( v ) > 2 else None
+
+    if node.name == "translate":
+        return (
+            ( 1, 0, 0, x ),
+            ( 0, 1, 0, y ),
+            ( 0, 0, 1, z or 0 ),
+            ( 0, 0, 0, 1 ))
+
+    if node.name == "scale":
+        return (
+            ( x, 0, 0, 0 ),
+            ( 0, y, 0, 0 ),
+            ( 0, 0, 1 if z == None else z, 0 ),
+            ( 0, 0, 0, 1 ))
+
+    if node.name == "mirror":
+        z = z or 0
+        length = x * x + y * y + z * z
+        if length == 0:
+            return _identity_matrix
+        n = ( x, y, z )
+        return tuple(
+            tuple( ( i == j ) - 2 * n[ i ] * n[ j ] / length
+                for j in range( 3 )) + ( 0, )
+            for i in range( 3 )) + (( 0, 0, 0, 1 ), )
+
+    if node.name == "rotate":
+        # OpenSCAD rotates around x first, then y, then z
+        cx, sx = _cos_sin( x )
+        cy, sy = _cos_sin( y )
+        cz, sz = _cos_sin( z or 0 )
+        rx = (( 1, 0, 0, 0 ), ( 0, cx, -sx, 0 ), ( 0, sx, cx, 0 ), ( 0, 0, 0, 1 ))
+        ry = (( cy, 0, sy, 0 ), ( 0, 1, 0, 0 ), ( -sy, 0, cy, 0 ), ( 0, 0, 0, 1 ))
+        rz = (( cz, -sz, 0, 0 ), ( sz, cz, 0, 0 ), ( 0, 0, 1, 0 ), ( 0, 0, 0, 1 ))
+        return _matrix_product( rz, _matrix_product( ry, rx ))
+
+    return None
+
+_identity_matrix = (
+    ( 1, 0, 0, 0 ), ( 0, 1, 0, 0 ), ( 0, 0, 1, 0 ), ( 0, 0, 0, 1 ))
+
+# the kind of facets (see profile) of each OpenSCAD operation
+# that has a $fn argument
+_facet_kinds = {
+    "circle" : "circle", "cylinder" : "circle", "sphere" : "sphere",
+    "text" : "text", "linear_extrude" : "extrude",
+    "rotate_extrude" : "extrude" }
+
+def _apply_profile( root: _node, settings: profile ) -> _node:
+    """the tree, with the facets limited, and the Minkowski sums
+    replaced, as specified by the profile
+    """
+
+    def replace( node: _node ) -> _node:
+        if isinstance( node, _boolean ):
+            if node.name == "minkowski" and not settings.minkowski:
+                return _boolean( "union", node.children )
+            return node
+        if not isinstance( node, ( _primitive, _transform ) ) \
+            or node.args == None:
+            return node
+        maximum = settings.facets.get( _facet_kinds.get( node.name ) )
+        if maximum == None or not any(
+            name == "$fn" and not _is_symbolic( value ) and value > maximum
+            for name, value in node.args
+        ):
+            return node
+        args = tuple( ( name, maximum )
+            if name == "$fn" and not _is_symbolic( value ) and value > maximum
+            else ( name, value ) for name, value in node.args )
+        if isinstance( node, _primitive ):
+            return _primitive( node.name, args )
+        return _transform( node.name, args, node.children[ 0 ] )
+
+    return _rewrite( root, replace )
+
+def _fuse_transforms( root: _node ) -> _node:
+    """the tree, with each chain of directly nested
+    translate, rotate, mirror, scale and multmatrix
+    nodes replaced by a single multmatrix node
+
+    This saves OpenSCAD a node (and the text a nesting level)
+    for each transformation in a chain.
+    A single transformation is left as it is.
+    """
+
+    def fuse( node ):
+        outer = _transform_matrix( node )
+        if outer == None:
+            return node
+        inner = _transform_matrix( node.children[ 0 ] )
+        if inner == None:
+            return node
+        return _transform( "multmatrix",
+            ( ( None, _matrix_product( outer, inner ) ), ),
+            node.children[ 0 ].children[ 0 ] )
+
+    return _rewrite( root, fuse )
+
+
+# the operations that produce nothing from nothing
+_empty_preserving = (
+    "translate", "rotate", "mirror", "scale", "multmatrix", "resize",
+    "color", "linear_extrude", "rotate_extrude", "hull", "for", "render" )
+
+def _is_identity( node: _node ) -> bool:
+    """whether the node is a transformation that does nothing
+    """
+    if _is_symbolic( node.args ):
+        return False
+    if node.name in ( "translate", "rotate", "mirror" ):
+        return all( v == 0 for v in node.args[ 0 ][ 1 ] )
+    if node.name == "scale":
+        return all( v == 1 for v in node.args[ 0 ][ 1 ] )
+    if node.name == "multmatrix":
+        return node.args[ 0 ][ 1 ] == _identity_matrix
+    return False
+
+def _simplify( root: _node ) -> _node:
+    """the tree, without the structure that has no effect
+
+    - operations on nothing (like the translation of an empty
+      negative) are removed
+    - transformations that do nothing (like identity) are removed
+    - nothing is removed from unions and subtracted from differences
+    - a difference of nothing is nothing,
+      and so is an intersection with nothing
+    - a union of one shape is that shape
+    - nested unions, the first parts of nested differences, the
+      subtracted unions of differences, and nested intersections
+      are flattened into one node
+
+    This makes both the text and the CSG tree of OpenSCAD smaller.
+    Raw OpenSCAD text is left as it is.
+    """
+
+    def is_empty( node ):
+        return node is _empty or (
+            isinstance( node, _raw ) and node.text.strip() == "" )
+
+    def simplify( node ):
+        if isinstance( node, _transform ):
+            if node.args == None:
+                return node
+            if is_empty( node.children[ 0 ] ):
+                return _empty if node.name in _empty_preserving else node
+            if type( node ) == _transform and _is_identity( node ):
+                return node.children[ 0 ]
+            return node
+
+        if not isinstance( node, _boolean ):
+            return node
+
+        children = node.children
+        if node.name == "union":
+            children = [ c for c in children if not is_empty( c ) ]
+            children = [ x for c in children for x in (
+                c.children if isinstance( c, _boolean ) and c.name == "union"
+                else ( c, ) ) ]
+
+        elif node.name == "difference":
+            if children == () or is_empty( children[ 0 ] ):
+                return _empty
+            first = children[ 0 ]
+            rest = [ c for c in children[ 1 : ] if not is_empty( c ) ]
+            rest = [ x for c in rest for x in (
+                c.children if isinstance( c, _boolean ) and c.name == "union"
+                else ( c, ) ) ]
+            if isinstance( first, _boolean ) and first.name == "difference":
+                children = list( first.children ) + rest
+            else:
+                children = [ first ] + rest
+
+        elif node.name == "intersection":
+            if any( is_empty( c ) for c in children ):
+                return _empty
+            children = [ x for c in children for x in (
+                c.children
+                if isinstance( c, _boolean ) and c.name == "intersection"
+                else ( c, ) ) ]
+
+        else:
+            if all( is_empty( c ) for c in children ):
+                return _empty
+            return node
+
+        if len( children ) == 0:
+            return _empty
+        if len( children ) == 1:
+            return children[ 0 ]
+        if len( children ) == len( node.children ) and all(
+            a is b for a, b in zip( children, node.children )
+        ):
+            return node
+        return _boolean( node.name, tuple( children ))
+
+    return _rewrite( root, simplify )
+
+
+#============================================================================
+#
+# serialization
+#
+#============================================================================
+
+# the kind of each class of node in a serialized tree
+_node_kinds = {
+    _raw : "raw",
+    _primitive : "primitive",
+    _transform : "transform",
+    _boolean : "boolean",
+    _repeat : "repeat",
+}
+
+# the version of the serialized format, stored with the tree
+_serialization_version = 1
+
+# the start of a file in the binary format
+_binary_header = b"psml\n"
+
+def _kind( node: _node ) -> str:
+    """the kind of the node in a serialized tree
+    """
+    if isinstance( node, _stream ):
+        raise ValueError(
+            "a union_of() can only be written, "
+            "it can not be saved or fingerprinted" )
+    if isinstance( node, _call ):
+        raise ValueError(
+            "a shape made by a module can not be saved" )
+    return _node_kinds[ type( node ) ]
+
+def _table( root: _node ) -> list:
+    """the tree as a list of plain records, each child before its parent
+
+    A record is a ( kind, name, args, children ) tuple, in which
+    children are the indexes of the records of the children,
+    and name is the text of a raw node.
+    A node that occurs at more than one place in the tree
+    is recorded only once.
+    """
+    index = {}
+    records = []
+    for node in _postorder( root ):
+        index[ id( node ) ] = len( records )
+        records.append( (
+            _kind( node ),
+            node.text if isinstance( node, _raw ) else node.name,
+            _plain( getattr( node, "args", None ) ),
+            tuple( index[ id( child ) ] for child in node.children ) ) )
+    return records
+
+def _from_table( records ) -> _node:
+    """the tree of which the records were created by _table()
+
+    A node that was recorded once is created once,
+    so the sharing of nodes is the same as in the original tree.
+    """
+    nodes = []
+    for kind, name, args, children in records:
+        children = tuple( nodes[ i ] for i in children )
+        if kind == "raw":
+            node = _empty if name == "" else _raw( name )
+        elif kind == "primitive":
+            node = _primitive( name, args )
+        elif kind == "transform":
+            node = _transform( name, args, children[ 0 ] )
+        elif kind == "boolean":
+            node = _boolean( name, children )
+        elif kind == "repeat":
+            node = _repeat( args[ 0 ][ 1 ], children[ 0 ] )
+        else:
+            raise ValueError( "unknown kind of node '%s'" % kind )
+        nodes.append( node )
+    return nodes[ -1 ]
+
+def _plain( x ):
+    """x, with all numbers replaced by Python ints and floats
+
+    The arguments can contain other kinds of numbers (like a
+    Fraction, or a numpy float), which marshal can not save,
+    and of which the repr() is not that of the equal float.
+    """
+    if type( x ) == tuple:
+        return tuple( map( _plain, x ) )
+    if isinstance( x, bool ) or not isinstance( x, numbers.Real ):
+        return x
+    if isinstance( x, numbers.Integral ):
+        return int( x )
+    return float( x )
+
+def _canonical( x ):
+    """x, with all integers that are not booleans replaced by floats
+
+    An integer is written to OpenSCAD the same as the equal float,
+    so it must have the same fingerprint.
+    """
+    if type( x ) == tuple:
+        return tuple( map( _canonical, x ) )
+    x = _plain( x )
+    if type( x ) == int:
+        return float( x )
+    return x
+
+def _digest( root: _node ) -> bytes:
+    """the fingerprint (SHA-256 digest) of the tree
+
+    The digest of a node is computed from its kind, its name (or
+    text) and its arguments, and the digests of its children.
+    It depends only on the structure of the tree (not on the
+    identity of the Python objects), so it is the same in each run.
+    Each node computes its digest only once: a node never changes,
+    and for a new tree only the digests of the new nodes are computed.
+    The tree is walked without recursion.
+    """
+    stack = [ root ]
+    while stack:
+        node = stack[ -1 ]
+        if node._cached_digest != None:
+            stack.pop()
+            continue
+        missing = [ c for c in node.children if c._cached_digest == None ]
+        if missing:
+            stack.extend( missing )
+            continue
+        stack.pop()
+        digest = hashlib.sha256( repr( (
+            "call" if isinstance( node, _call ) else _kind( node ),
+            node.text if isinstance( node, _raw ) else node.name,
+            _canonical( getattr( node, "args", None ) ) ) ).encode( "utf-8" ) )
+        for child in node.children:
+            digest.update( child._cached_digest )
+        if isinstance( node, _call ):
+            digest.update( _digest( node.body ) )
+        node._cached_digest = digest.digest()
+    return root._cached_digest
+
+def _tuples( x ):
+    """x, with all lists (recursively) replaced by tuples
+
+    JSON has no tuples, but the arguments in a node are tuples.
+    """
+    if isinstance( x, list ):
+        return tuple( _tuples( v ) for v in x )
+    return x
+
+def _shape_from_table( version: int, records ) -> shape:
+    """the shape of which the records were created from its solid tree
+    """
+    if version != _serialization_version:
+        raise ValueError(
+            "shape was saved in format version %s, this is version %d" % (
+                version, _serialization_version ) )
+    solid = _from_table( records )
+    result = shape( solid.children[ 0 ], solid.children[ 1 ] )
+    result._solid_node = solid
+    return result
+
+def load( file_name: str = "output" ) -> shape:
+    """read a shape from the specified file
+
+    :param file_name: name of the file
+
+    This function reads a shape that was written by save(),
+    in either the binary or the JSON format.
+
+    If the file_name does not contain a "."
+    the suffix ".psml" is appended.
+
+    .. code-block::
+
+        screw_and_nut_column( 35, m3_20 ).save( "column" )
+        # later, maybe in another run
+        column = load( "column" )
+    """
+    if not "." in file_name:
+        file_name = file_name + ".psml"
+
+    with open( file_name, "rb" ) as f:
+        data = f.read()
+    if data.startswith( _binary_header ):
+        version, records = marshal.loads( data[ len( _binary_header ) : ] )
+    else:
+        tree = json.loads( data.decode( "utf-8" ) )
+        version = tree[ "psml" ]
+        records = [
+            ( kind, name, _tuples( args ), children )
+            for kind, name, args, children in tree[ "nodes" ] ]
+    return _shape_from_table( version, records )
 
 
 #============================================================================
@@ -262,6 +1723,57 @@ def _select_existing_file( list, default ):
          return file
    return default      
 
+def _same_content( a: str, b: str ) -> bool:
+    """whether the two files have the same bytes
+
+    filecmp.cmp() is not used, because it remembers its results
+    by size and modification time, which can be the same for
+    a file that was changed within the resolution of the clock.
+    """
+    if os.path.getsize( a ) != os.path.getsize( b ):
+        return False
+    with open( a, "rb" ) as fa, open( b, "rb" ) as fb:
+        while True:
+            block = fa.read( 1 << 16 )
+            if block != fb.read( 1 << 16 ):
+                return False
+            if not block:
+                return True
+
+def _write_if_changed( file_name: str, produce, binary: bool = False ) -> bool:
+    """write a file atomically, and only when its content changes
+
+    :param file_name: name of the file
+    :param produce: function that writes the content to the open file
+    :param binary: whether the file is opened in binary mode
+
+    The content is written to a temporary file next to the file,
+    which then replaces the file (in one step), so the file is never
+    half-written, not even when produce() raises an exception.
+    When the content is the same as that of the existing file,
+    the existing file (and its modification time) is left as it is,
+    so a program that watches the file (like OpenSCAD with automatic
+    reload) is not triggered.
+
+    The result is whether the file was written.
+    """
+    temporary = "%s.%d-%d.tmp" % (
+        file_name, os.getpid(), threading.get_ident() )
+    try:
+        with open( temporary, "wb" if binary else "w" ) as f:
+            produce( f )
+        if os.path.isfile( file_name ) and _same_content(
+            temporary, file_name
+        ):
+            os.remove( temporary )
+            return False
+        os.replace( temporary, file_name )
+        return True
+    except BaseException:
+        if os.path.exists( temporary ):
+            os.remove( temporary )
+        raise
+
 class shape:
     """2D or 3D shape
 
@@ -269,9 +1781,16 @@ class shape:
     +, - or * operators.
     """
 
+    # the tree of the shape with its negative parts subtracted,
+    # once it has been created
+    _solid_node = None
+
+    # the (simplified) text of the shape, once it has been produced
+    _cached_text = None
+
     def __init__( self,
-       positive : str,
-       negative : str = ""
+       positive : _str_or_node,
+       negative : _str_or_node = ""
     ):
         """a simple shape
 
@@ -283,8 +1802,10 @@ class shape:
         This constructor creates a shape that has a
         fixed textual representation.
         """
-        self._positive_text = positive
-        self._negative_text = negative
+        self._positive_node = (
+            _raw( positive ) if isinstance( positive, str ) else positive )
+        self._negative_node = (
+            _raw( negative ) if isinstance( negative, str ) else negative )
 
     def _merge( self ) -> shape:
        """hook for shape_list
@@ -297,7 +1818,7 @@ class shape:
         This method returns the OpenSCAD representation of the
         positive parts of the shape.
         """
-        return self._merge()._positive_text
+        return self._merge()._positive_node._text()
 
     def _negative( self ):
         """the OpenSCAD text representation of the dominant negative parts
@@ -305,7 +1826,20 @@ class shape:
         This method returns the OpenSCAD representation of the
         dominant negative parts of the shape.
         """
-        return self._merge()._negative_text
+        return self._merge()._negative_node._text()
+
+    def _solid( self ) -> _node:
+        """the tree of the shape with its negative parts subtracted
+
+        The tree is created only once, so a shape that is used
+        in many places (for instance by negative or positive)
+        shares the same tree.
+        """
+        merged = self._merge()
+        if merged._solid_node == None:
+            merged._solid_node = _boolean( "difference", (
+                merged._positive_node, merged._negative_node ) )
+        return merged._solid_node
 
     def __str__( self ) -> str:
         """the OpenSCAD text representation of the shape
@@ -313,12 +1847,32 @@ class shape:
         This method returns the OpenSCAD representation of the
         shape.
         """
-        return ( self - shape( self._negative(), "" ))._positive()
-
-    def write( self, file_name = "output" ):
+        merged = self._merge()
+        if merged._cached_text == None:
+            chunks = []
+            _writer( chunks.append, simplify = True ).node( merged._solid() )
+            merged._cached_text = "".join( chunks ).rstrip( "\n" )
+        return merged._cached_text
+
+    def write( self,
+        file_name = "output",
+        modules: bool = False,
+        fuse_transforms: bool = False,
+        simplify: bool = True,
+        compact: bool = False,
+        quantum: float = 0,
+        profile: Union[ str, profile, None ] = None
+    ) -> bool:
         """write the shape to the specified file
 
         :param file_name: name of the file
+        :param modules: write repeated parts as OpenSCAD modules
+        :param fuse_transforms: combine chains of transformations
+        :param simplify: leave out what has no effect (default: True)
+        :param compact: write for OpenSCAD instead of for humans
+        :param quantum: round the numbers to multiples of this value
+        :param profile: the profile (or the name of a profile, like
+                        "draft") that is applied (see profile)
 
         This function prints the OpenSCAD representation of the
         shape to the indicated file (default: output.scad).
@@ -328,6 +1882,42 @@ class shape:
         If the file_name does not contain a "."
         the suffix ".scad" is appended.
 
+        The file is written only when its content changes,
+        so OpenSCAD (when it automatically reloads the file)
+        does not render an unchanged model again.
+        The file is replaced in one step, so it is never left
+        half-written. The result is whether the file was written.
+
+        When modules is True, each part that occurs more than once
+        in the model (like the subject of a repeat8, which itself
+        is repeated) is written only once, as an OpenSCAD module,
+        and each occurrence is written as a call of that module.
+        This keeps the file size (and the time OpenSCAD needs to read it)
+        proportional to the number of distinct parts.
+
+        When fuse_transforms is True, each chain of directly nested
+        shifts (vectors), rotates, mirrors and scales is written as a
+        single OpenSCAD multmatrix, which OpenSCAD evaluates as one node.
+
+        By default the OpenSCAD code is simplified: operations on
+        nothing (like the empty negative parts of most shapes),
+        shifts by identity and similar transformations that have no
+        effect are left out, and nested unions, differences and
+        intersections are combined.
+        Set simplify to False to get the full structure of the model.
+
+        When compact is True the file is written without indentation,
+        newlines and spaces. Such a file is smaller and is read faster by OpenSCAD,
+        but it is hard to read for a human.
+
+        Numbers are written with as few digits as are needed
+        to write them exactly (1 instead of 1.000000).
+        When a quantum (like 0.001) is specified, each number is
+        rounded to a multiple of it. Models that differ only
+        by (for instance) rounding errors in a calculation then
+        produce the same file, which is not written again,
+        and the file can be smaller.
+
         .. code-block::
 
             # these lines have the same effect
@@ -339,14 +1929,96 @@ class shape:
         if not "." in file_name: 
             file_name = file_name+ ".scad"
             
-        f = open( file_name, "w" )
-        f.write( str( self ) )
-        f.close()
+        return _write_if_changed( file_name, lambda f:
+            _writer( f.write, modules, fuse_transforms, simplify, compact,
+                quantum = quantum, settings = _profile( profile ) ).node(
+                    self._solid() ) )
         
-    def stl( self, file_name = "output" ):
+    def save( self, file_name = "output" ) -> bool:
+        """save the shape to the specified file
+
+        :param file_name: name of the file
+
+        This function saves the tree of the shape to the indicated
+        file (default: output.psml), from which it can be read by load().
+        This avoids re-running an expensive generator in a later run.
+        A part that occurs more than once in the shape is saved once.
+
+        If the file_name does not contain a "."
+        the suffix ".psml" is appended.
+        When the file_name ends in ".json" the shape is saved as
+        JSON text, otherwise in a (faster) binary format
+        which is specific to the version of Python.
+
+        Like write(), this function writes the file only when its
+        content changes, and returns whether the file was written.
+
+        A shape can also be pickled, for instance to send it to
+        another process. This uses the same (binary) representation.
+
+        .. code-block::
+
+            # these lines have the same effect
+            sphere( 10 ).save()
+            sphere( 10 ).save( "output" )
+            sphere( 10 ).save( "output.psml" )
+        """
+
+        if not "." in file_name:
+            file_name = file_name + ".psml"
+
+        records = _table( self._solid() )
+        if _parameters and any( _is_symbolic( r[ 2 ] ) for r in records ):
+            raise ValueError( "a shape that uses parameters can not be saved" )
+        if file_name.endswith( ".json" ):
+            return _write_if_changed( file_name, lambda f: json.dump(
+                { "psml" : _serialization_version, "nodes" : records },
+                f, separators = ( ",", ":" ) ) )
+        return _write_if_changed( file_name, lambda f: f.write(
+            _binary_header
+            + marshal.dumps( ( _serialization_version, records ) ) ),
+            binary = True )
+
+    def fingerprint( self ) -> str:
+        """a fingerprint of the shape
+
+        This function returns a string that is the same for
+        shapes that are built the same way, also in different runs
+        of a program, and (almost certainly) different for shapes
+        that are built in a different way. It can be used as
+        the key of a cache, or to detect duplicate work.
+
+        The fingerprint is computed from the structure of the shape,
+        without producing its OpenSCAD text, and each part of a shape
+        computes its fingerprint only once, so for a shape that is
+        built from existing shapes only the new parts are handled.
+        Shapes that have the same geometry but are built in a
+        different way (like a + b and b + a) have different fingerprints.
+
+        .. code-block::
+
+            # these shapes have the same fingerprint
+            a = vector( 1, 2, 3 ) ** box( 10, 10, 10 )
+            b = vector( 1, 2, 3 ) ** box( 10, 10, 10 )
+        """
+        return _digest( self._solid() ).hex()
+
+    def __reduce__( self ):
+        """pickle support: a shape is pickled as the records of its tree
+        """
+        return ( _shape_from_table,
+            ( _serialization_version, _table( self._solid() ) ) )
+
+    def stl(
+        self,
+        file_name = "output",
+        profile: Union[ str, profile, None ] = None
+    ) -> bool:
         """write the stl to the specified file
 
         :param file_name: name of the file
+        :param profile: the profile (or the name of a profile, like
+                        "draft") that is applied (see profile)
 
         This function uses OpenSCAD to render, and then 
         export the stl representation to the specified 
@@ -357,6 +2029,22 @@ class shape:
         
         A temporary file _output.scad will be created
         which is the input for OpenSCAD.
+        Repeated parts are written to it as modules,
+        and chains of transformations as a single multmatrix,
+        in the compact format (see write).
+        Parts marked by prerender are rendered on their own,
+        and imported (see prerender).
+
+        Rendered stl files are cached in the directory
+        stl_cache_directory (default: ~/.cache/psml), by a hash of
+        the OpenSCAD text and the OpenSCAD version.
+        When the same model is rendered again, the cached file
+        is used (as a hard link, or a copy), without running OpenSCAD.
+        When the total size of the cached files exceeds
+        stl_cache_size (default: 1 GB), the least recently
+        used files are removed. Set stl_cache_directory to None
+        to render without the cache.
+        The result is whether the cached file was used.
         
         NOTE: the path to openscad is now 
 
@@ -371,17 +2059,51 @@ class shape:
         if not file_name.endswith( ".stl" ): 
             file_name = file_name+ ".stl"
         
-        self.write( "_output.scad" )
+        _write_for_render( self, "_output.scad", _profile( profile ) )
+        
+        return _render( "_output.scad", file_name ).cached
+
+    async def stl_async(
+        self,
+        file_name = "output",
+        timeout: Union[ float, None ] = None,
+        profile: Union[ str, profile, None ] = None
+    ) -> render_result:
+        """write the stl to the specified file, without blocking
+
+        :param file_name: name of the file
+        :param timeout: the maximum time (in seconds) for the render
+        :param profile: the profile (or the name of a profile, like
+                        "draft") that is applied (see profile)
+
+        This is the asyncio version of stl(): it is a coroutine,
+        so while OpenSCAD renders, the event loop can do other work,
+        like creating other models or starting other renders.
+        Each call writes its OpenSCAD file in a temporary directory
+        of its own, so concurrent renders don't interfere.
+        The stl cache is used, like by stl().
+
+        When the render takes longer than the timeout,
+        OpenSCAD is stopped and asyncio.TimeoutError is raised.
+        When the call is cancelled, OpenSCAD is stopped too.
+        In both cases the stl file is not changed.
+
+        The result is a render_result (see render_many).
+
+        .. code-block::
+
+            async def parts():
+                await asyncio.gather(
+                    lid.stl_async( "lid" ),
+                    base.stl_async( "base", timeout = 600 ) )
+            asyncio.run( parts() )
+        """
         
-        openscad = _select_existing_file( [
-           "C:/Program Files (x86)/OpenSCAD/OpenSCAD.exe",
-           "C:/Program Files/OpenSCAD/OpenSCAD.exe",
-        ], "openscad" )   
+        if not file_name.endswith( ".stl" ): 
+            file_name = file_name+ ".stl"
         
-        s = subprocess.run( [ 
-            openscad, 
-            "_output.scad", 
-            "-o", file_name ] )        
+        return await _render_async(
+            self, file_name, timeout, _profile( profile ) )
 
     def gcode( self, file_name = "output" ):
         """write the gcode to the specified file
@@ -438,12 +2160,12 @@ class shape:
         """subtract two shapes
         """
         if rhs == None: return self
-        return _apply2( "difference()", "union()", self, rhs )
+        return _apply2( "difference", "union", self, rhs )
 
     def __mul__( self, rhs: shape ) -> shape:
         """intersect two shapes
         """
-        return _apply2( "intersection()", "union()", self, rhs )
+        return _apply2( "intersection", "union", self, rhs )
 
 class _shape_list( shape ):
     """list of shapes
@@ -456,8 +2178,23 @@ class _shape_list( shape ):
     generate deeply nested OpenSCAD unions, which makes the generated
     OpenSCAD file difficult to read. This class 'gathers' shapes
     that are added, in order to generate a flattened union.
+
+    A model is often built by repeatedly adding to the same union,
+    like m += ... in a loop. Copying the list for each addition would
+    make this quadratic. Instead, shape lists share an append-only
+    list of shapes, each shape list using only the first part of it.
+    When a shape is added to the shape list that uses the full list,
+    the new shape list extends that same list (amortized O(1)),
+    which does not affect the existing shape list.
+    Otherwise the relevant part of the list is copied.
+    Extending a shared list is done under a lock, so shape lists
+    that are created in different threads from the same shape list
+    each get their own part.
     """
 
+    # the lock for extending a shared list
+    _lock = threading.Lock()
+
     def __init__( self,
         a: _shape_or_shape_list,
         b: _shape_or_shape_list
@@ -467,25 +2204,546 @@ class _shape_list( shape ):
        A shape list is created from two parts.
        Both can be either an shape, or an _shape_list.
        """
-       self.list = []
+       if isinstance( a, _shape_list ):
+          with _shape_list._lock:
+             if a._length == len( a._items ):
+                self._items = a._items
+                self._add( b )
+                self._length = len( self._items )
+                self._merged = {}
+                return
+       self._items = []
        self._add( a )
        self._add( b )
+       self._length = len( self._items )
+       self._merged = {}
 
     def _add( self, x: _shape_or_shape_list ):
        if isinstance( x, _shape_list ):
-          self.list = self.list + x.list
+          self._items.extend( x._list() )
        else:
-          self.list.append( x )
+          self._items.append( x )
 
-    def _merge( self, function = "union()" ) -> shape:
-        return shape(
-            function + "{\n" +
-               _indent( "".join( x._positive() for x in self.list )) +
-            "}",
-            function + "{\n" +
-               _indent( "".join( x._negative() for x in self.list )) +
-            "}"
-        )
+    def _list( self ) -> Iterable[ shape ]:
+       """the shapes in this shape list
+       """
+       return itertools.islice( self._items, self._length )
+
+    def _merge( self, function = "union" ) -> shape:
+        """the shapes combined by the function (default: union)
+
+        The result is created only once for each function:
+        the shapes in a shape list never change.
+        """
+        if function not in self._merged:
+           merged = [ x._merge() for x in self._list() ]
+           self._merged[ function ] = shape(
+               _boolean( function,
+                  tuple( x._positive_node for x in merged )),
+               _boolean( function,
+                  tuple( x._negative_node for x in merged )) )
+        return self._merged[ function ]
+
+
+def union_of( shapes: Iterable[ shape ] ) -> shape:
+    """the union of the shapes, which are taken from an iterable
+    while the union is written
+
+    :param shapes: the shapes, for instance from a generator
+
+    This function returns a shape that is the union of the shapes
+    (like a + b + ...), but the shapes are not stored:
+    each shape is taken from the iterable (and forgotten) when
+    the union is written to a file, so a model with a very large
+    number of parts can be written without having all of them
+    in memory. The negative parts of the shapes are kept in a
+    temporary file until they are written.
+
+    Such a union can be used like any other shape,
+    but it can be written (or converted to text) only once,
+    and it can not be saved or fingerprinted.
+    Repeated parts in it are not written as modules.
+
+    .. code-block::
+
+        # a million spheres
+        union_of(
+            vector( x, y ) ** sphere( 1 )
+            for x in range( 1000 ) for y in range( 1000 ) ).write()
+    """
+    source = _stream_source( shapes )
+    return shape( _stream( source, False ), _stream( source, True ) )
+
+
+#============================================================================
+#
+# rendering
+#
+#============================================================================
+
+# the directory in which rendered stl files are cached
+# (None: no cache), and the maximum total size of those files
+stl_cache_directory = os.path.join(
+    os.path.expanduser( "~" ), ".cache", "psml" )
+stl_cache_size = 1 << 30
+
+@functools.lru_cache( maxsize = None )
+def _openscad_version( openscad: str, modified: float ) -> str:
+    """the version text of the OpenSCAD executable
+
+    The modification time is part of the arguments so that
+    an updated executable is asked again.
+    """
+    try:
+        result = subprocess.run( [ openscad, "--version" ],
+            stdout = subprocess.PIPE, stderr = subprocess.STDOUT )
+    except OSError:
+        return "unknown"
+    return result.stdout.decode( errors = "replace" ).strip()
+
+def _render_key( scad_file: str, openscad: str, options ) -> str:
+    """the cache key of a render: a hash of the OpenSCAD text,
+    the OpenSCAD version and the options
+    """
+    modified = os.path.getmtime( openscad ) \
+        if os.path.isfile( openscad ) else 0
+    digest = hashlib.sha256()
+    for text in [ "psml stl", _openscad_version( openscad, modified ) ] \
+        + list( options ):
+        digest.update( text.encode() + b"\0" )
+    with open( scad_file, "rb" ) as f:
+        for block in iter( lambda: f.read( 1 << 16 ), b"" ):
+            digest.update( block )
+    return digest.hexdigest()
+
+def _place( source: str, file_name: str ):
+    """make file_name a hard link to (or else a copy of) the source
+
+    The file is replaced in one step, and an existing file_name
+    is never written into (it could be a link to a cached file).
+    """
+    if os.path.isfile( file_name ) and os.path.samefile( source, file_name ):
+        return
+    temporary = "%s.%d-%d.tmp" % (
+        file_name, os.getpid(), threading.get_ident() )
+    try:
+        try:
+            os.link( source, temporary )
+        except OSError:
+            shutil.copyfile( source, temporary )
+        os.replace( temporary, file_name )
+    except BaseException:
+        if os.path.exists( temporary ):
+            os.remove( temporary )
+        raise
+
+# numbers that make the names of temporary files unique
+_temporary_numbers = itertools.count()
+
+def _temporary_name( cached: str ) -> str:
+    """the name of a file to render to, for the cache file
+
+    The file is in the cache directory, so it can be moved into the
+    cache in one step, and it has the suffix of the cache file,
+    because OpenSCAD uses the suffix to select the format.
+    The .tmp in the name keeps it from being evicted.
+    """
+    base, suffix = os.path.splitext( cached )
+    return "%s.%d-%d.tmp%s" % (
+        base, os.getpid(), next( _temporary_numbers ), suffix )
+
+def _evict( directory: str, size: int ):
+    """remove the least recently used files from the cache directory
+    until their total size is at most the size
+
+    Files that are still being rendered are not removed.
+    """
+    entries = []
+    for entry in os.scandir( directory ):
+        if entry.name.endswith( ".stl" ) and not ".tmp" in entry.name:
+            try:
+                status = entry.stat()
+            except OSError:
+                continue
+            entries.append( ( status.st_mtime, status.st_size, entry.path ) )
+    total = sum( entry[ 1 ] for entry in entries )
+    for _, entry_size, path in sorted( entries ):
+        if total <= size:
+            break
+        try:
+            os.remove( path )
+        except OSError:
+            pass
+        total -= entry_size
+
+class render_result:
+    """the result of rendering a file (see render_many)
+
+    :ivar file_name: the name of the rendered file
+    :ivar cached: whether the file was taken from the cache
+    :ivar returncode: the exit code of OpenSCAD (0 when cached)
+    :ivar seconds: the (wall clock) time it took
+    :ivar memory: the peak memory use of OpenSCAD, in bytes
+                  (None when it was not run, or not measured)
+    """
+
+    def __init__( self,
+        file_name: str,
+        cached: bool,
+        returncode: int,
+        seconds: float,
+        memory: Union[ int, None ]
+    ):
+        self.file_name = file_name
+        self.cached = cached
+        self.returncode = returncode
+        self.seconds = seconds
+        self.memory = memory
+
+    def __repr__( self ) -> str:
+        return "render_result(%r, cached=%r, returncode=%r, " \
+            "seconds=%.3f, memory=%r)" % ( self.file_name, self.cached,
+            self.returncode, self.seconds, self.memory )
+
+def _run( command ) -> Tuple[ int, Union[ int, None ] ]:
+    """run the command, and return its exit code
+    and its peak memory use (when that can be measured)
+    """
+    process = subprocess.Popen( command )
+    if not hasattr( os, "wait4" ):
+        return process.wait(), None
+    try:
+        _, status, usage = os.wait4( process.pid, 0 )
+    except ChildProcessError:
+        return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode( status )
+
+    # ru_maxrss is in kilobytes, except on macOS
+    return process.returncode, usage.ru_maxrss * (
+        1 if sys.platform == "darwin" else 1024 )
+
+def _openscad() -> str:
+    """the OpenSCAD executable
+    """
+    return _select_existing_file( [
+       "C:/Program Files (x86)/OpenSCAD/OpenSCAD.exe",
+       "C:/Program Files/OpenSCAD/OpenSCAD.exe",
+    ], "openscad" )
+
+def _cache_file( scad_file: str, file_name: str, openscad: str, options ):
+    """the name of the cache file for the render
+    (None when there is no cache)
+    """
+    if stl_cache_directory == None:
+        return None
+    os.makedirs( stl_cache_directory, exist_ok = True )
+    return os.path.join( stl_cache_directory,
+        _render_key( scad_file, openscad, options )
+        + os.path.splitext( file_name )[ 1 ] )
+
+def _from_cache( cached: str, file_name: str ) -> bool:
+    """place the cached file as the file, and mark it as used
+
+    The result is whether the cache had the file.
+    """
+    try:
+        os.utime( cached )
+        _place( cached, file_name )
+        return True
+    except FileNotFoundError:
+        return False
+
+def _to_cache( rendered: str, cached: str, file_name: str ):
+    """move the rendered file into the cache,
+    and place it as the file
+    """
+    os.replace( rendered, cached )
+    _place( cached, file_name )
+    _evict( stl_cache_directory, stl_cache_size )
+
+def _is_prerendered( node: _node ) -> bool:
+    """whether the node is the render() of prerender
+    """
+    return type( node ) is _transform \
+        and node.name == "render" and node.args == ()
+
+# the cache files of the prerendered subtrees that OpenSCAD
+# failed to render (in this run), which are not rendered again
+_failed_prerenders = set()
+
+def _prerendered( root: _node, settings: Union[ profile, None ] ) -> _node:
+    """the tree, with each subtree that is marked by prerender
+    replaced by the import of its stl file from the cache
+
+    Each such subtree is written to an OpenSCAD file of its own
+    (in which the subtrees inside it are already imports),
+    of which the stl file is taken from the cache, or rendered
+    and stored in the cache. A subtree that is empty (like the
+    negative part of most shapes) is removed. A subtree that can not
+    be rendered (like a 2D subtree), or that uses top-level
+    parameters, is left as it is, and a subtree that could not be
+    rendered is not tried again.
+    """
+    if stl_cache_directory == None:
+        return root
+    openscad = _openscad()
+
+    def replace( node: _node ) -> _node:
+        if not _is_prerendered( node ) or any(
+            _is_symbolic( getattr( n, "args", None ) )
+            for n in _postorder( node )
+        ):
+            return node
+        with tempfile.TemporaryDirectory( prefix = "psml-" ) as directory:
+            scad_file = os.path.join( directory, "part.scad" )
+            with open( scad_file, "w" ) as f:
+                _writer( f.write, True, True, True, True,
+                    settings = settings ).node( node.children[ 0 ] )
+            if os.path.getsize( scad_file ) == 0:
+                return _empty
+            cached = _cache_file( scad_file, "part.stl", openscad, () )
+            if cached in _failed_prerenders:
+                return node
+            if os.path.isfile( cached ):
+                os.utime( cached )
+            else:
+                # render in the cache directory, which could be on
+                # another file system than the temporary directory
+                rendered = _temporary_name( cached )
+                try:
+                    returncode, _ = _run(
+                        [ openscad, scad_file, "-o", rendered ] )
+                    if returncode != 0 or not os.path.isfile( rendered ):
+                        _failed_prerenders.add( cached )
+                        return node
+                    os.replace( rendered, cached )
+                finally:
+                    if os.path.exists( rendered ):
+                        os.remove( rendered )
+                _evict( stl_cache_directory, stl_cache_size )
+        return _primitive( "import",
+            ( ( None, cached.replace( os.sep, "/" ) ), ) )
+
+    return _rewrite( root, replace )
+
+def _write_for_render(
+    subject: shape,
+    scad_file: str,
+    settings: Union[ profile, None ]
+):
+    """write the shape to the OpenSCAD file that is rendered:
+    compact, with modules and fused transformations,
+    with the profile applied,
+    and with the prerendered subtrees imported
+    """
+    _write_if_changed( scad_file, lambda f:
+        _writer( f.write, True, True, True, True, settings = settings ).node(
+            _prerendered( subject._solid(), settings ) ) )
+
+def _render( scad_file: str, file_name: str, options = () ) -> render_result:
+    """render the OpenSCAD file to the file, using the cache
+
+    A file that was rendered before (with the same OpenSCAD text,
+    OpenSCAD version and options) is taken from the cache.
+    The cached file is marked as used (by its modification time),
+    so the least recently used files are removed first
+    when the cache exceeds its size.
+    """
+    start = time.perf_counter()
+    openscad = _openscad()
+    command = [ openscad, scad_file ] + list( options )
+
+    cached = _cache_file( scad_file, file_name, openscad, options )
+    if cached == None:
+        returncode, memory = _run( command + [ "-o", file_name ] )
+        return render_result( file_name, False, returncode,
+            time.perf_counter() - start, memory )
+    if _from_cache( cached, file_name ):
+        return render_result( file_name, True, 0,
+            time.perf_counter() - start, None )
+
+    temporary = _temporary_name( cached )
+    try:
+        returncode, memory = _run( command + [ "-o", temporary ] )
+        if returncode == 0 and os.path.isfile( temporary ):
+            _to_cache( temporary, cached, file_name )
+    finally:
+        if os.path.exists( temporary ):
+            os.remove( temporary )
+    return render_result( file_name, False, returncode,
+        time.perf_counter() - start, memory )
+
+async def _render_async(
+    subject: shape,
+    file_name: str,
+    timeout: Union[ float, None ],
+    settings: Union[ profile, None ],
+    options = ()
+) -> render_result:
+    """write the shape and render it to the file, in a temporary
+    directory of its own, without blocking the event loop
+
+    With the cache, the file is rendered in the cache directory
+    (which could be on another file system than the temporary
+    directory), from which it is moved into the cache.
+    """
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    with tempfile.TemporaryDirectory( prefix = "psml-" ) as directory:
+        scad_file = os.path.join( directory, "output.scad" )
+        rendered = os.path.join( directory,
+            "output" + os.path.splitext( file_name )[ 1 ] )
+
+        # writing the OpenSCAD file is Python work,
+        # which is done in another thread (in the current context)
+        await loop.run_in_executor( None, functools.partial(
+            contextvars.copy_context().run,
+            _write_for_render, subject, scad_file, settings ) )
+
+        openscad = _openscad()
+        cached = await loop.run_in_executor( None,
+            _cache_file, scad_file, file_name, openscad, options )
+        if cached != None and _from_cache( cached, file_name ):
+            return render_result( file_name, True, 0,
+                time.perf_counter() - start, None )
+
+        if cached != None:
+            rendered = _temporary_name( cached )
+        try:
+            process = await asyncio.create_subprocess_exec(
+                openscad, scad_file, *options, "-o", rendered )
+            try:
+                returncode = await asyncio.wait_for(
+                    process.wait(), timeout )
+            except BaseException:
+                # cancelled or timed out: stop OpenSCAD
+                if process.returncode == None:
+                    process.kill()
+                    await asyncio.shield( process.wait() )
+                raise
+
+            if returncode == 0 and os.path.isfile( rendered ):
+                if cached == None:
+                    _place( rendered, file_name )
+                else:
+                    _to_cache( rendered, cached, file_name )
+        finally:
+            if os.path.exists( rendered ):
+                os.remove( rendered )
+        return render_result( file_name, False, returncode,
+            time.perf_counter() - start, None )
+
+def render_many(
+    parts,
+    jobs: Union[ int, None ] = None,
+    max_memory: Union[ int, None ] = None,
+    memory: int = 1 << 30,
+    profile: Union[ str, profile, None ] = None
+):
+    """render a number of shapes or OpenSCAD files to stl files,
+    in parallel
+
+    :param parts: a dict of stl file names and the shapes
+                  (or OpenSCAD file names) to render to them,
+                  or a list of shapes and OpenSCAD file names
+    :param jobs: the maximum number of parallel renders
+                 (default: the number of cores)
+    :param max_memory: the maximum total memory use of the parallel
+                       renders in bytes (default: no maximum)
+    :param memory: the estimated memory use of a render,
+                   until the use of a finished render has been measured
+    :param profile: the profile (or the name of a profile) that is
+                    applied to the shapes (see profile)
+
+    A render by OpenSCAD uses a single core, but it can need
+    a lot of memory. This function runs up to jobs renders
+    at the same time, but (when max_memory is specified)
+    only as many as fit in max_memory,
+    according to the largest memory use of the renders so far.
+    (A render that alone exceeds max_memory is run on its own.)
+    The stl cache is used, like by shape.stl().
+
+    A shape is written (compact, like by shape.stl()) to an
+    OpenSCAD file with the name of the stl file, preceded by _ and
+    with the .scad suffix, which is removed after the render
+    (it is written next to the stl file, so the relative file names
+    in the shape are found). In a list, an OpenSCAD file is rendered
+    to a file with its name and the .stl suffix, and a shape
+    to output_<n>.stl, where <n> is its index in the list.
+
+    The result is a list of a render_result for each part,
+    in the order of the parts.
+
+    .. code-block::
+
+        results = render_many( {
+            "lid.stl" : lid,
+            "base.stl" : base,
+            "knob.stl" : "knob.scad",
+        }, max_memory = 8 << 30 )
+        for result in results:
+            print( result.file_name, result.returncode, result.seconds )
+    """
+    if isinstance( parts, dict ):
+        parts = list( parts.items() )
+    else:
+        parts = [ ( None, part ) for part in parts ]
+    for _, part in parts:
+        if not isinstance( part, ( shape, str ) ):
+            raise TypeError( "render_many() renders shapes and "
+                "OpenSCAD file names, not %s" % type( part ).__name__ )
+    parts = [ ( file_name if file_name != None
+        else "output_%d.stl" % i if isinstance( part, shape )
+        else os.path.splitext( part )[ 0 ] + ".stl", part )
+        for i, ( file_name, part ) in enumerate( parts ) ]
+    if jobs == None:
+        jobs = os.cpu_count() or 1
+    settings = _profile( profile )
+
+    # the memory reserved by the running renders, and the largest
+    # memory use of a finished render (None until one is measured)
+    condition = threading.Condition()
+    budget = { "reserved" : 0, "largest" : None }
+
+    def estimate():
+        return memory if budget[ "largest" ] == None else budget[ "largest" ]
+
+    def render( file_name, part ):
+        start = time.perf_counter()
+        if isinstance( part, shape ):
+            directory, name = os.path.split( file_name )
+            scad_file = os.path.join( directory,
+                "_" + os.path.splitext( name )[ 0 ] + ".scad" )
+            _write_for_render( part, scad_file, settings )
+        else:
+            scad_file = part
+
+        with condition:
+            condition.wait_for( lambda: max_memory == None
+                or budget[ "reserved" ] == 0
+                or budget[ "reserved" ] + estimate() <= max_memory )
+            reserved = estimate()
+            budget[ "reserved" ] += reserved
+        result = None
+        try:
+            result = _render( scad_file, file_name )
+        finally:
+            if isinstance( part, shape ) and os.path.exists( scad_file ):
+                os.remove( scad_file )
+            with condition:
+                budget[ "reserved" ] -= reserved
+                if result != None and result.memory != None:
+                    budget[ "largest" ] = max(
+                        budget[ "largest" ] or 0, result.memory )
+                condition.notify_all()
+        result.seconds = time.perf_counter() - start
+        return result
+
+    # each render runs in a copy of the context of the caller
+    context = contextvars.copy_context()
+    with concurrent.futures.ThreadPoolExecutor( jobs ) as pool:
+        return list( pool.map(
+            lambda part: context.copy().run( render, *part ), parts ) )
 
 
 #============================================================================
@@ -643,12 +2901,14 @@ class vector:
     def __str__( self ) -> str:
         """convert to [ x, y ] or [ x, y, z ] string format
         """
-        if self.z == None:
-            return "[ %f, %f ]" % ( self.x, self.y)
-        else:
-            return "[ %f, %f, %f ]" % ( self.x, self.y, self.z )
-
-    def __pow__( self, subject : _shape_or_none ) -> _shape_or_none:
+        return "[ %s ]" % ", ".join(
+            _number_text( float( v ), 0 )
+                for v in self._list() if v != None )
+
+    def __pow__(
+        self,
+        subject : _shape_or_modifier_or_none
+    ) -> _shape_or_modifier_or_none:
         """apply the vector to a shape
 
         :param subject: the shape that is to be displaced (shifted)
@@ -658,8 +2918,13 @@ class vector:
 
         The subject can be None instead of a shape,
         in which case the result will also be None.
+
+        When the subject is a modifier (or a vector) the result is
+        a modifier that applies both (see modifier).
         """
-        return apply( "translate( %s )" % str( self ), subject )
+        if isinstance( subject, ( modifier, vector ) ):
+            return _translation( self ) ** subject
+        return _apply1( "translate", ( ( None, _value( self ) ), ), subject )
 
 identity = vector( 0, 0, 0 )
 """modifier that doesn't change its subject
@@ -782,7 +3047,7 @@ def rectangle(
     s = vector( x, y )
 
     if rounding == 0:
-        return shape( "square( %s );" % str( s ) )
+        return shape( _primitive( "square", ( ( None, _value( s ) ), ) ) )
 
     else:
         x, y, r = s.x, s.y, rounding
@@ -826,7 +3091,7 @@ def box(
     s = vector( x, y, z )
 
     if rounding == 0:
-        return shape( "cube( %s );" % str( s ) )
+        return shape( _primitive( "cube", ( ( None, _value( s ) ), ) ) )
 
     else:
         x, y, z, r = s.x, s.y, s.z, rounding
@@ -886,7 +3151,9 @@ def circle(
     its radius or its diameter.
     The circle is in the x-y plane, with its center at the origin.
     Optionally, the number of circle facets can be specified.
-    The default is the global variable number_of_circle_facets.
+    The default is set by facets()
+    (initially the global variable number_of_circle_facets),
+    or derived from the size by tolerance().
 
     .. figure::  ../examples/images/example_circle1_128.png
         :target: ../examples/images/example_circle1_512.png
@@ -899,14 +3166,14 @@ def circle(
         :lines: 10
     """
 
-    # number_of_circle_facets can't be the default value because
-    # that would not reflect a change of number_of_circle_facets
-    if facets == None: facets = number_of_circle_facets
-    
     r = _radius_from_radius_or_diameter( radius, diameter )
 
-    return shape(
-        "circle( r=%f, $fn=%d );" % ( r, facets ) )
+    # the number of facets can't be the default value because
+    # that would not reflect a change made by facets()
+    if facets == None: facets = _default_facets( "circle", r )
+
+    return shape( _primitive( "circle",
+        ( ( "r", r ), ( "$fn", facets ) ) ) )
 
 def cylinder(
     height:    _float_or_vector = None,
@@ -929,7 +3196,9 @@ def cylinder(
     at its base, and its height.
 
     Optionally, the number of circle facets can be specified.
-    The default is the global variable number_of_circle_facets.
+    The default is set by facets()
+    (initially the global variable number_of_circle_facets),
+    or derived from the size by tolerance().
 
     .. figure::  ../examples/images/example_cylinder1_128.png
         :target: ../examples/images/example_cylinder1_512.png
@@ -942,7 +3211,7 @@ def cylinder(
     height, radius = sizes.x, sizes.y
 
     # see remark in circle
-    if facets == None: facets = number_of_circle_facets  
+    if facets == None: facets = _default_facets( "circle", radius )
         
     if rounded_top:
         return (
@@ -952,8 +3221,8 @@ def cylinder(
                facets = facets )
             + up( height - radius ) ** sphere( radius = radius ) )
     else:
-        return shape( "cylinder( h=%f, r=%f, $fn=%d );" 
-            % ( height, radius, facets ) )
+        return shape( _primitive( "cylinder",
+            ( ( "h", height ), ( "r", radius ), ( "$fn", facets ) ) ) )
 
 def cone(
    height:     _float_or_vector = None,
@@ -979,7 +3248,9 @@ def cone(
     and its radius or diameter at its top.
 
     Optionally, the number of circle facets can be specified.
-    The default is the global variable number_of_circle_facets.
+    The default is set by facets()
+    (initially the global variable number_of_circle_facets),
+    or derived from the size by tolerance().
 
     .. figure::  ../examples/images/example_cone1_128.png
         :target: ../examples/images/example_cone1_512.png
@@ -992,11 +3263,12 @@ def cone(
     sizes = vector( height, r1, r2 )
 
     # see remark in circle
-    if facets == None: facets = number_of_circle_facets
+    if facets == None: facets = _default_facets(
+        "circle", max( float( sizes.y ), float( sizes.z ) ) )
 
-    return shape(
-        "cylinder( h=%f, r1=%f, r2=%f, $fn=%d );"
-            % ( sizes.x, sizes.y, sizes.z, facets ) )
+    return shape( _primitive( "cylinder", (
+        ( "h", sizes.x ), ( "r1", sizes.y ), ( "r2", sizes.z ),
+        ( "$fn", facets ) ) ) )
 
 def sphere(
     radius:    _float_or_none = None,
@@ -1013,7 +3285,9 @@ def sphere(
     its radius or its diameter.
 
     Optionally, the number of sphere facets can be specified.
-    The default is the global variable number_of_sphere_facets.
+    The default is set by facets()
+    (initially the global variable number_of_sphere_facets),
+    or derived from the size by tolerance().
 
     .. figure::  ../examples/images/example_sphere1_128.png
         :target: ../examples/images/example_sphere1_512.png
@@ -1021,13 +3295,13 @@ def sphere(
         :lines: 10-12
     """
 
-    # see remark in circle
-    if facets == None: facets = number_of_sphere_facets
-
     r = _radius_from_radius_or_diameter( radius, diameter )
 
-    return shape(
-        "sphere( r=%f, $fn=%d );" % ( r, facets ) )
+    # see remark in circle
+    if facets == None: facets = _default_facets( "sphere", r )
+
+    return shape( _primitive( "sphere",
+        ( ( "r", r ), ( "$fn", facets ) ) ) )
 
 def text(
     txt: str,
@@ -1043,7 +3317,9 @@ def text(
     :param args: extra arguments
 
     Optionally, the number of facets can be specified.
-    The default is the global variable number_of_text_facets.
+    The default is set by facets()
+    (initially the global variable number_of_text_facets),
+    or derived from the size by tolerance().
 
     .. figure::  ../examples/images/example_text1_128.png
         :target: ../examples/images/example_text1_512.png
@@ -1066,15 +3342,14 @@ def text(
     useful to scale a text to a know size.
     """
 
-    # see remark in circle
-    if facets == None: facets = number_of_circle_facets
+    # see remark in circle (a quarter of the letter height
+    # is about the radius of the curves in the letters)
+    if facets == None: facets = _default_facets( "circle", height / 4 )
 
-    if args != "":
-       args = ", " + args.replace( "'", '"' )
+    extra = () if args == "" else ( ( "", args.replace( "'", '"' ) ), )
 
-    return shape(
-        'text( "%s", %f, $fn=%d %s );'
-            % ( txt, height, facets, args ) )
+    return shape( _primitive( "text",
+        ( ( None, txt ), ( None, height ), ( "$fn", facets ) ) + extra ) )
 
 def polygon( points: Iterable[ _vector_or_pair ] ) -> shape:
     """polygon shape
@@ -1091,15 +3366,14 @@ def polygon( points: Iterable[ _vector_or_pair ] ) -> shape:
         :lines: 10-12
     """
 
-    def _2d_point_str( p: _vector_or_pair ):
+    def _2d_point( p: _vector_or_pair ):
         if isinstance( p, vector ):
-            return "[%f,%f]" % ( p.x, p.y )
+            return ( p.x, p.y )
         else:
-            return "[%f,%f]" % ( p[ 0 ], p[ 1 ] )
+            return ( p[ 0 ], p[ 1 ] )
 
-    return shape(
-        'polygon( [ %s ] );' % (
-           "".join( _2d_point_str( p ) + "," for p in points ) ) )
+    return shape( _primitive( "polygon",
+        ( ( None, tuple( _2d_point( p ) for p in points ) ), ) ) )
 
 
 #============================================================================
@@ -1119,6 +3393,11 @@ class modifier:
     The subject can be None instead of a shape,
     in which case the result will also be None.
 
+    The modifiers of the library (like rotate or repeat4) store
+    their parameters as data instead of in a function, so they
+    (and the shapes made with them) can be pickled, for instance
+    to send them to another process.
+
     .. figure::  ../examples/images/example_modifier1_128.png
         :target: ../examples/images/example_modifier1_512.png
     .. literalinclude:: ../examples/example_modifier1.py
@@ -1128,26 +3407,131 @@ class modifier:
     def __init__( self, function ):
         self.function = function
 
-    def __pow__( self, subject: _shape_or_none ) -> _shape_or_none:
+    def _apply( self, subject: shape ) -> shape:
+        """the modified subject
+
+        The modifiers of the library override this method.
+        """
+        return self.function( subject )
+
+    def __pow__(
+        self,
+        subject: _shape_or_modifier_or_none
+    ) -> _shape_or_modifier_or_none:
+        """apply the modifier to a shape, or combine it with a modifier
+
+        A modifier can be applied to another modifier
+        (or a vector, which shifts its subject).
+        The result is a modifier that applies both,
+        which can be reused for any number of subjects.
+        Such a combined modifier does its work only once:
+        a chain of transformations (like up( 5 ) ** rotate( 0, 0, 90 ))
+        is applied to a subject in a single step,
+        and its text is produced once when the model is written.
+        """
         if subject == None:
            return None
-        else:
-           return self.function( subject )
+        if isinstance( subject, vector ):
+           subject = _translation( subject )
+        if isinstance( subject, modifier ):
+           return _pipeline( self, subject )
+        return self._apply( subject )
+
+class _transformation( modifier ):
+    """modifier that applies a chain of OpenSCAD transformations
+
+    Each operation is a ( name, args ) pair, the outermost first.
+    When args is None, the name is the full text of the operation
+    (see _apply1). The name "for" is a repetition (see _repeat),
+    of which the args hold the positions.
+    """
 
-def _minkowski():
-    return modifier(
-        lambda subject :
-           subject._merge( "minkowski()" )
-           if isinstance( subject, _shape_list )
-           else subject )
+    def __init__( self, *operations: Tuple[ str, _arguments_or_none ] ):
+        self.operations = operations
+
+    def _apply( self, subject: shape ) -> shape:
+        subject = subject._merge()
+        positive, negative = subject._positive_node, subject._negative_node
+        for name, args in reversed( self.operations ):
+            if name == "for":
+                positive = _repeat( args[ 0 ][ 1 ], positive )
+                negative = _repeat( args[ 0 ][ 1 ], negative )
+            else:
+                positive = _transform( name, args, positive )
+                negative = _transform( name, args, negative )
+        return shape( positive, negative )
+
+def _translation( v: vector ) -> _transformation:
+    """the modifier that shifts its subject by the vector
+    """
+    return _transformation( ( "translate", ( ( None, _value( v ) ), ) ) )
+
+class _repetition( _transformation ):
+    """modifier that repeats its subject at a number of positions
+    """
+
+    def __init__( self, positions: Iterable[ vector ] ):
+        _transformation.__init__( self, ( "for", ( ( None,
+            tuple( _value( p ) for p in positions ) ), ) ) )
+
+class _pipeline( modifier ):
+    """modifiers that are applied as one, the last one first
+
+    Adjacent transformations are combined into one transformation,
+    which is applied in a single step.
+    """
+
+    def __init__( self, outer: modifier, inner: modifier ):
+        steps = []
+        for step in (
+            outer.steps if isinstance( outer, _pipeline ) else ( outer, ) ) + (
+            inner.steps if isinstance( inner, _pipeline ) else ( inner, )
+        ):
+            if steps and isinstance( steps[ -1 ], _transformation ) \
+                and isinstance( step, _transformation ):
+                steps[ -1 ] = _transformation(
+                    *steps[ -1 ].operations, *step.operations )
+            else:
+                steps.append( step )
+        self.steps = tuple( steps )
+
+    def _apply( self, subject: shape ) -> shape:
+        for step in reversed( self.steps ):
+            subject = step._apply( subject )
+        return subject
+
+class _minkowski( modifier ):
+    """modifier that merges a sum of shapes by minkowski
+    """
+
+    def __init__( self ):
+        pass
+
+    def _apply( self, subject: shape ) -> shape:
+        if isinstance( subject, _shape_list ):
+            return subject._merge( "minkowski" )
+        positive, negative = subject._positive_node, subject._negative_node
+        if isinstance( positive, _repeat ) and isinstance( negative, _repeat ):
+            # the copies made by a repetition are a sum of objects
+            def shifted( node, p ):
+                return _transform( "translate", ( ( None, p ), ), node )
+            copies = [ shape(
+                shifted( positive.children[ 0 ], p ),
+                shifted( negative.children[ 0 ], p ) )
+                for p in positive.args[ 0 ][ 1 ] ]
+            if len( copies ) > 1:
+                return functools.reduce( operator.add, copies )._merge(
+                    "minkowski" )
+        return subject
 
 minkowski = _minkowski()
 """minkowski sum
 
 This modifier computes the Minkowski sum of two or more
-2D or 3D objects. It must be applied to a sum of objects.
+2D or 3D objects. It must be applied to a sum of objects,
+or to the copies made by a repetition (like repeat2).
 When it is applied to something else (for instance
-the result of applying a modifier) it is a no-op.
+the result of applying another modifier) it is a no-op.
 
     .. figure::  ../examples/images/example_minkowski1_128.png
         :target: ../examples/images/example_minkowski1_512.png
@@ -1177,16 +3561,16 @@ def extrude(
     :param facets: number of steps used in the extrusion
 
     Optionally, the number of steps can be specified.
-    The default is the global variable number_of_extrude_facets.
+    The default is set by facets()
+    (initially the global variable number_of_extrude_facets).
     """
 
     # see remark in circle
-    if facets == None: facets = number_of_extrude_facets
+    if facets == None: facets = _default_facets( "extrude" )
 
-    return modifier(
-        lambda subject : apply(
-            "linear_extrude( height=%f, twist=%f, scale=%f, $fn=%d )\n"
-                % ( height, twist, scale, facets ), subject ) )
+    return _transformation( ( "linear_extrude", (
+        ( "height", height ), ( "twist", twist ),
+        ( "scale", scale ), ( "$fn", facets ) ) ) )
                 
 def rotate_extrude(
     angle: float = 360, 
@@ -1195,12 +3579,11 @@ def rotate_extrude(
 ):              
 
     # see remark in circle
-    if facets == None: facets = number_of_extrude_facets
+    if facets == None: facets = _default_facets( "extrude" )
     
-    return modifier(
-        lambda subject : apply(
-            "rotate_extrude( angle=%f, convexity=%d, $fn=%d )\n"
-                % ( angle, convexity, facets ), subject ) )    
+    return _transformation( ( "rotate_extrude", (
+        ( "angle", angle ), ( "convexity", convexity ),
+        ( "$fn", facets ) ) ) )
 
 def mirror(
     x: _float_or_vector,
@@ -1231,8 +3614,7 @@ def mirror(
 
     normal_vector = vector( x, y, z )
 
-    return modifier( lambda subject :
-        apply( "mirror( %s )" % str( normal_vector ), subject ) )
+    return _transformation( ( "mirror", ( ( None, _value( normal_vector ) ), ) ) )
 
 def rotate(
     x: _float_or_vector,
@@ -1263,8 +3645,7 @@ def rotate(
 
     angles = vector( x, y, z )
 
-    return modifier( lambda subject :
-        apply( "rotate( %s )" % str( angles ), subject ) )
+    return _transformation( ( "rotate", ( ( None, _value( angles ) ), ) ) )
 
 def scale(
     x: _float_or_vector,
@@ -1297,12 +3678,10 @@ def scale(
 
     directions = vector( x, y, z )
 
-    return modifier( lambda subject :
-        apply( "scale( %s )" % str( directions ), subject ) )
+    return _transformation( ( "scale", ( ( None, _value( directions ) ), ) ) )
 
 def _hull():
-    return modifier( lambda subject :
-         apply( "hull()", subject ) )
+    return _transformation( ( "hull", () ) )
 
 hull = _hull()
 """convex hull
@@ -1356,16 +3735,20 @@ def resize(
     """
 
     amounts = vector( x, y, z )
-    auto = str( [ x == None for x in amounts._list() ] ).lower()
+    auto = tuple( x == None for x in amounts._list() )
+
+    return _transformation( ( "resize",
+        ( ( None, _value( amounts ) ), ( "auto", auto ) ) ) )
+
+class _negative( modifier ):
+    """modifier that makes its subject a dominant negative
+    """
 
-    return modifier( lambda subject :
-        apply(
-            "resize( %s, auto=%s )" % ( str( amounts ), auto ),
-            subject ) )
+    def __init__( self ):
+        pass
 
-def _negative():
-    return modifier( lambda subject :
-        shape( "", str( subject ) ) )
+    def _apply( self, subject: shape ) -> shape:
+        return shape( _empty, subject._solid() )
 
 negative = _negative()
 """makes its subject a dominant negative
@@ -1374,10 +3757,15 @@ This manipulator makes its subject a dominant negative:
 something that will not be filled.
 """
 
-def _positive():
-    return modifier(
-       lambda subject :
-          shape( str( subject ), "" ) )
+class _positive( modifier ):
+    """modifier that removes the dominant negatives of its subject
+    """
+
+    def __init__( self ):
+        pass
+
+    def _apply( self, subject: shape ) -> shape:
+        return shape( subject._solid(), _empty )
 
 positive = _positive()
 """removes dominant negatives
@@ -1387,6 +3775,24 @@ the dominant emptinesses in its subject, so an
 solid can be placed in the space of what was a dominant emptiness.
 """
 
+prerender = _transformation( ( "render", () ) )
+"""renders its subject on its own, once
+
+The subject is written as an OpenSCAD render(), which OpenSCAD
+renders once and then reuses (during a session).
+When the model is rendered by psml (shape.stl(), stl_async()
+or render_many()), the subject is rendered to an stl file of its own,
+which is kept in the stl cache, and the model imports that file.
+When only another part of the model changes, the subject
+(like a screw column, or a rounded shell) is then not rendered again.
+(This does not apply to a subject that uses top-level parameters.)
+
+.. code-block::
+
+    column = prerender ** screw_and_nut_column( 30, m3_20 )
+    ( box( 50, 50, 2 ) + repeat4( 40, 40 ) ** column ).stl()
+"""
+
 def repeat2(
     x: _float_or_vector,
     y: float = None,
@@ -1412,10 +3818,9 @@ def repeat2(
     """
 
     v = vector( x, y, z )
+    origin = vector( 0, 0 ) if v.z == None else vector( 0, 0, 0 )
 
-    return modifier(
-       lambda subject :
-          subject + ( v ** subject ) )
+    return _repetition( [ origin, v ] )
 
 def repeat4(
     x: _float_or_vector,
@@ -1440,13 +3845,11 @@ def repeat4(
 
     v = vector( x, y )
 
-    return modifier(
-       lambda subject :
-           vector(   0,   0 ) ** subject +
-           vector( v.x,   0 ) ** subject +
-           vector(   0, v.y ) ** subject +
-           vector( v.x, v.y ) ** subject
-    )
+    return _repetition( [
+       vector(   0,   0 ),
+       vector( v.x,   0 ),
+       vector(   0, v.y ),
+       vector( v.x, v.y ) ] )
 
 def repeat8(
     x: _float_or_vector,
@@ -1473,17 +3876,215 @@ def repeat8(
 
     v = vector( x, y, z )
 
-    return modifier(
-        lambda subject :
-            vector(   0,   0,   0 ) ** subject +
-            vector( v.x,   0,   0 ) ** subject +
-            vector(   0, v.y,   0 ) ** subject +
-            vector( v.x, v.y,   0 ) ** subject +
-            vector(   0,   0, v.z ) ** subject +
-            vector( v.x,   0, v.z ) ** subject +
-            vector(   0, v.y, v.z ) ** subject +
-            vector( v.x, v.y, v.z ) ** subject
-    )
+    return _repetition( [
+       vector(   0,   0,   0 ),
+       vector( v.x,   0,   0 ),
+       vector(   0, v.y,   0 ),
+       vector( v.x, v.y,   0 ),
+       vector(   0,   0, v.z ),
+       vector( v.x,   0, v.z ),
+       vector(   0, v.y, v.z ),
+       vector( v.x, v.y, v.z ) ] )
+
+
+#============================================================================
+#
+# parametric modules
+#
+#============================================================================
+
+class _module_definition:
+    """the OpenSCAD modules for the positive and for the negative
+    parts of the shapes made by a function decorated with module
+
+    The negative is None when the shapes have no negative parts.
+    """
+
+    def __init__( self,
+        name: str,
+        parameters: Tuple[ str, ... ],
+        positive: _node,
+        negative: _node_or_none
+    ):
+        self.name = name
+        self.parameters = parameters
+        self.positive = positive
+        self.negative = negative
+
+# the names of the modules that have been made
+# the names that are used by modules, initially the OpenSCAD
+# built-in modules (a module with such a name would call itself)
+_module_names = set( [
+    "children", "circle", "color", "cube", "cylinder", "difference",
+    "echo", "hull", "import", "intersection", "linear_extrude",
+    "minkowski", "mirror", "multmatrix", "offset", "polygon",
+    "polyhedron", "projection", "render", "resize", "rotate",
+    "rotate_extrude", "scale", "sphere", "square", "surface",
+    "text", "translate", "union" ] )
+
+def _unique_module_name( name: str ) -> str:
+    """the name, or the name with a number appended when the name
+    is already used by another module
+    """
+    unique, n = name, 1
+    while unique in _module_names:
+        n += 1
+        unique = "%s_%d" % ( name, n )
+    _module_names.add( unique )
+    return unique
+
+def _module_text( root: _node, symbols: bool ) -> str:
+    """the text of the tree, without the modules that it calls
+    """
+    chunks = []
+    writer = _writer( chunks.append, symbols = symbols )
+    writer._tree( root, 0, {} )
+    writer.flush()
+    return "".join( chunks )
+
+def _is_number( x, types ) -> bool:
+    return isinstance( x, types ) and not isinstance( x, bool )
+
+class _parametric_module:
+    """a function decorated with module
+    """
+
+    def __init__( self, function ):
+        functools.update_wrapper( self, function )
+        self.function = function
+        self.signature = inspect.signature( function )
+
+        # the module definitions, by their parameters and texts
+        self.definitions = {}
+
+    def __call__( self, *args, **kwargs ):
+        bound = self.signature.bind( *args, **kwargs )
+        bound.apply_defaults()
+        concrete = self.function( *args, **kwargs )
+        result = concrete
+        if isinstance( concrete, shape ):
+            # first try with all numbers as parameters,
+            # then with only the floats (an int might be used
+            # for instance in a range())
+            for types in ( ( int, float ), ( float, ) ):
+                made = self._module_shape( bound, concrete._merge(), types )
+                if made != None:
+                    result = made
+                    break
+        return result
+
+    def _module_shape(
+        self,
+        bound: inspect.BoundArguments,
+        concrete: shape,
+        types: Tuple[ type, ... ]
+    ) -> _shape_or_none:
+        """the shape as a call of a module, or None when that fails
+
+        The numbers (of the types) and the vectors of those numbers
+        in the arguments are the parameters of the module.
+        The shape is made again, with expressions for the parameters,
+        and that shape must have the same text as the concrete shape.
+        """
+        parameters, values = [], []
+        arguments = bound.arguments.copy()
+        for name, value in bound.arguments.items():
+            if self.signature.parameters[ name ].kind in (
+                inspect.Parameter.VAR_POSITIONAL,
+                inspect.Parameter.VAR_KEYWORD
+            ):
+                continue
+            if _is_number( value, types ):
+                arguments[ name ] = _expression(
+                    value, name, getattr( value, "strict", False ) )
+                values.append( ( name, value ) )
+            elif isinstance( value, vector ) and all(
+                v == None or _is_number( v, types ) for v in value._list()
+            ):
+                arguments[ name ] = vector( *(
+                    None if v == None
+                    else _expression( v, "%s[%d]" % ( name, i ),
+                        getattr( v, "strict", False ) )
+                    for i, v in enumerate( value._list() ) ) )
+                values.append( ( name, _value( value ) ) )
+            else:
+                continue
+            parameters.append( name )
+
+        symbolic = inspect.BoundArguments( self.signature, arguments )
+        try:
+            made = self.function( *symbolic.args, **symbolic.kwargs )
+        except Exception:
+            return None
+        if not isinstance( made, shape ):
+            return None
+        made = made._merge()
+
+        nodes = ( made._positive_node, made._negative_node )
+        if tuple( _module_text( node, False ) for node in nodes ) != tuple(
+            _module_text( node, False ) for node in (
+                concrete._positive_node, concrete._negative_node )
+        ):
+            return None
+
+        parameters = tuple( parameters )
+        texts = tuple( _module_text( node, True ) for node in nodes )
+        definition = self.definitions.get( ( parameters, texts ) )
+        if definition == None:
+            negative = _simplify( nodes[ 1 ] )
+            if isinstance( negative, _raw ) and negative.text.strip() == "":
+                negative = None
+            else:
+                negative = nodes[ 1 ]
+            definition = self.definitions[ ( parameters, texts ) ] = (
+                _module_definition(
+                    _unique_module_name( self.__name__ ),
+                    parameters, nodes[ 0 ], negative ) )
+
+        values = tuple( values )
+        return shape(
+            _call( definition, False, values ),
+            _empty if definition.negative == None
+                else _call( definition, True, values ) )
+
+def module( function ):
+    """decorator that writes the shapes made by a function
+    as calls of a parametric OpenSCAD module
+
+    :param function: a function that returns a shape
+
+    A shape that is made by a function is normally written in full
+    each time it is used, for instance for each of the four
+    screw columns of a box. When the function is decorated with
+    module, the shape is written once as an OpenSCAD module,
+    of which the parameters are the numbers and vectors that
+    are passed to the function. Each shape made by the function is
+    written as a call of that module, with its own parameter values.
+    This keeps the file size (and the time OpenSCAD needs to read it)
+    proportional to the number of different parts.
+
+    Other arguments (like the screw of a screw_and_nut_column)
+    are part of the module: for other values another module is made.
+    Likewise, when the function makes a different shape for some
+    values of its parameters (for instance because it compares
+    a parameter to decide what to make, or uses math.sin on it),
+    another module is made for those values.
+    Each call is checked: a shape is only written as a module call
+    when that produces the same model.
+
+    The shapes made by the decorated function can be used like
+    any other shape, but they can not be saved.
+
+    .. code-block::
+
+        @module
+        def pillar( height, diameter = 3 ):
+            return cylinder( height = height, diameter = diameter )
+
+        # written as one module, and three calls
+        model = pillar( 10 ) + right( 10 ) ** pillar( 20 ) + pillar( 30, 5 )
+    """
+    return _parametric_module( function )
 
 
 #============================================================================
@@ -1523,9 +4124,7 @@ _colors = [
 
 _current_module = __import__(__name__)
 for c in _colors:
-    # c_copy forces a copy, otherwise the *variable* c
-    # would be captured (and all colors would be Black
-    f = modifier( lambda s, c_copy = c: apply( 'color( "%s" )' % c_copy, s ))
+    f = _transformation( ( "color", ( ( None, c ), ) ) )
     setattr( _current_module, c, f )
     setattr( _current_module, c.lower(), f )
 
@@ -1574,8 +4173,8 @@ def color(
     # the range of OpenSCAD color channels is 0..1
     c = vector( r, g, b ) / 255.0
 
-    return modifier( lambda s:
-       apply( "color( %s, %f )" % ( str( c ), alpha ), s ) )
+    return _transformation( ( "color",
+       ( ( None, _value( c ) ), ( None, alpha ) ) ) )
 
 
 #============================================================================